@@ -0,0 +1,585 @@
+#!/usr/bin/env python
+############################################################################
+#
+# MODULE:       benchmark_r_in_srtm.py
+# AUTHOR(S):    Jonas Strobel, intern at mundialis and terrestris, Bonn
+# PURPOSE:      Benchmark of r.in.srtm with synthetic tiles, runs without
+#               a GRASS installation
+# COPYRIGHT:    (C) 2017 by stjo, and the GRASS Development Team
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+############################################################################
+"""Benchmark of r.in.srtm
+
+Synthetic 1-arcsec and 3-arcsec HGT tiles and SWBD RAW tiles, zipped and
+unzipped, are imported by main() of r.in.srtm.py with a stand-in for
+grass.script (and grass.pygrass for the native reader) installed in
+sys.modules, so no GRASS session is needed. For every scenario the wall
+time and the bytes read and written of the phases
+
+    zip test, copy, unzip, header, import
+
+are reported. Bytes are counted from the files and rows handled in each
+phase (uncompressed bytes for the native reader), so they do not depend
+on the page cache. The stand-ins of r.in.gdal and r.in.bin only copy the
+input into a file of CELL size, so their import times are not
+comparable with those of the native reader; compare runs of the same
+scenario between versions instead.
+
+Usage:
+
+    python benchmark_r_in_srtm.py [-n REPEAT] [-o results.json]
+                                  [-c baseline.json] [-t TOLERANCE]
+
+With -c, the median total time of every scenario is compared with the
+baseline written by -o of an earlier run; the benchmark exits with
+status 1 if a scenario is slower than the baseline by more than the
+tolerance (default: 0.25 = 25 %).
+"""
+
+import os
+import sys
+import json
+import types
+import shutil
+import timeit
+import zipfile
+import argparse
+import tempfile
+import subprocess
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                      'r.in.srtm.py')
+
+PHASES = ('zip test', 'copy', 'unzip', 'header', 'import')
+
+# library functions wrapped by instrument(), restored after each scenario
+copyfile = shutil.copyfile
+is_zipfile = zipfile.is_zipfile
+
+TILES = {
+    # kind: (tile name, number of rows and columns, bytes per cell, flags)
+    'hgt1': ('N51E010', 3601, 2, '1'),
+    'hgt3': ('N51E010', 1201, 2, ''),
+    'swbd': ('N51E010', 3601, 1, 'w'),
+}
+
+MODES = {
+    # mode: flags of r.in.srtm
+    'unzip': 'g',
+    'inproc': 'gz',
+    'native': '',
+}
+
+
+class Stats(object):
+    """Wall time and bytes read/written per phase"""
+    def __init__(self):
+        self.time = dict((phase, 0.0) for phase in PHASES)
+        self.read = dict((phase, 0) for phase in PHASES)
+        self.written = dict((phase, 0) for phase in PHASES)
+
+    def add(self, phase, seconds, read=0, written=0):
+        self.time[phase] += seconds
+        self.read[phase] += read
+        self.written[phase] += written
+
+    def total(self):
+        return sum(self.time.values())
+
+
+stats = Stats()
+
+
+def timed(phase, func, read=None, written=None):
+    """Wrap func to add its time and bytes to phase
+
+    read and written are called with the arguments of func (and written
+    also with its result) and return the number of bytes.
+    """
+    def wrapper(*args, **kwargs):
+        start = timeit.default_timer()
+        result = func(*args, **kwargs)
+        seconds = timeit.default_timer() - start
+        stats.add(phase, seconds,
+                  read(*args, **kwargs) if read else 0,
+                  written(result, *args, **kwargs) if written else 0)
+        return result
+    return wrapper
+
+
+def filesize(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def zip_members_size(path):
+    archive = zipfile.ZipFile(path)
+    try:
+        return sum(info.file_size for info in archive.infolist())
+    finally:
+        archive.close()
+
+
+def which(program):
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        if os.access(os.path.join(path, program), os.X_OK):
+            return True
+    return False
+
+
+def module_defaults():
+    """Return options and flags of r.in.srtm with their default answers"""
+    options = {}
+    flags = {}
+    block = None
+    key = None
+    for line in open(MODULE):
+        line = line.strip()
+        if line.startswith('#%option'):
+            block = options
+            key = None
+        elif line.startswith('#%flag'):
+            block = flags
+            key = None
+        elif line.startswith('#% key:') and block is not None:
+            key = line.split(':', 1)[1].strip()
+            block[key] = False if block is flags else ''
+        elif line.startswith('#% answer:') and block is options and key:
+            options[key] = line.split(':', 1)[1].strip()
+        elif line.startswith('#%end') or line.startswith('#%End'):
+            block = None
+    # G_OPT_* options without key
+    options.setdefault('input', '')
+    options.setdefault('output', '')
+    return options, flags
+
+
+def make_grass_standin(workdir, parsed):
+    """Install stand-ins for grass.script and grass.pygrass
+
+    parsed is the (options, flags) returned by the stand-in parser.
+    """
+    grass = types.ModuleType('grass')
+    script = types.ModuleType('grass.script')
+    exceptions = types.ModuleType('grass.exceptions')
+
+    class CalledModuleError(Exception):
+        pass
+
+    class ScriptError(Exception):
+        pass
+
+    exceptions.CalledModuleError = CalledModuleError
+    exceptions.ScriptError = ScriptError
+    raise_on_error = [False]
+
+    def fatal(msg):
+        if raise_on_error[0]:
+            raise ScriptError(msg)
+        sys.exit('ERROR: %s' % msg)
+
+    def tempfile_(create=True):
+        fd, path = tempfile.mkstemp(dir=workdir)
+        os.close(fd)
+        return path
+
+    def try_remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def try_rmdir(path):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+    def call(args, **kwargs):
+        devnull = open(os.devnull, 'w')
+        try:
+            return subprocess.call(args, stdout=devnull, **kwargs)
+        finally:
+            devnull.close()
+
+    def run_command(prog, **kwargs):
+        if prog in ('r.in.gdal', 'r.in.bin'):
+            # read the input like the import would and write a CELL map
+            cellfile = os.path.join(workdir, 'cell_' + kwargs['output'])
+            src = open(kwargs['input'], 'rb')
+            dst = open(cellfile, 'wb')
+            try:
+                while True:
+                    buf = src.read(1024 * 1024)
+                    if not buf:
+                        break
+                    dst.write(buf * (4 // int(kwargs.get('bytes', 2))))
+            finally:
+                src.close()
+                dst.close()
+        return 0
+
+    def read_command(prog, **kwargs):
+        if prog == 'g.proj':
+            return '+proj=longlat\n+datum=WGS84\n'
+        return ''
+
+    def parse_key_val(s, sep='=', **kwargs):
+        return dict(line.split(sep, 1) for line in s.splitlines() if sep in line)
+
+    def ignore(*args, **kwargs):
+        pass
+
+    # grass.script installs the gettext function _() as builtin
+    try:
+        import builtins
+    except ImportError:
+        import __builtin__ as builtins
+    builtins._ = lambda message: message
+
+    script.fatal = fatal
+    script.message = ignore
+    script.warning = ignore
+    script.verbose = ignore
+    script.debug = ignore
+    script.percent = ignore
+    script.raster_history = ignore
+    script.parser = lambda: parsed
+    script.overwrite = lambda: True
+    script.find_program = lambda program, *args: which(program)
+    script.find_file = lambda name, element='cell', mapset=None: {'file': ''}
+    script.set_raise_on_error = lambda value=True: raise_on_error.__setitem__(0, value)
+    script.get_raise_on_error = lambda: raise_on_error[0]
+    script.tempfile = tempfile_
+    script.try_remove = try_remove
+    script.try_rmdir = try_rmdir
+    script.call = call
+    script.run_command = run_command
+    script.read_command = read_command
+    script.parse_key_val = parse_key_val
+    script.region = lambda: {'n': 52, 's': 51, 'e': 11, 'w': 10}
+    grass.script = script
+    grass.exceptions = exceptions
+
+    modules = {'grass': grass, 'grass.script': script,
+               'grass.exceptions': exceptions}
+
+    if np is not None:
+        pygrass = types.ModuleType('grass.pygrass')
+        gis = types.ModuleType('grass.pygrass.gis')
+        region = types.ModuleType('grass.pygrass.gis.region')
+        raster = types.ModuleType('grass.pygrass.raster')
+        buffer_ = types.ModuleType('grass.pygrass.raster.buffer')
+
+        class Region(object):
+            def adjust(self, rows=False, cols=False):
+                pass
+
+            def set_raster_region(self):
+                pass
+
+        class Buffer(np.ndarray):
+            def __new__(cls, shape, mtype='FCELL', buffer=None):
+                dtype = {'CELL': np.int32, 'FCELL': np.float32,
+                         'DCELL': np.float64}[mtype]
+                return np.ndarray.__new__(cls, shape, dtype, buffer)
+
+        class RasterRow(object):
+            def __init__(self, name, mapset=''):
+                self.name = name
+
+            def open(self, mode='r', mtype=None, overwrite=False):
+                self.cellfile = open(os.path.join(workdir, 'cell_' + self.name), 'wb')
+
+            def put_row(self, row):
+                self.cellfile.write(row.tobytes())
+
+            def close(self):
+                self.cellfile.close()
+
+        region.Region = Region
+        raster.RasterRow = RasterRow
+        buffer_.Buffer = Buffer
+        modules.update({'grass.pygrass': pygrass, 'grass.pygrass.gis': gis,
+                        'grass.pygrass.gis.region': region,
+                        'grass.pygrass.raster': raster,
+                        'grass.pygrass.raster.buffer': buffer_})
+
+    sys.modules.update(modules)
+
+
+def load_module():
+    """Load r.in.srtm.py as module (the file name is no module name)"""
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location('r_in_srtm', MODULE)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['r_in_srtm'] = module
+        spec.loader.exec_module(module)
+    except ImportError:
+        import imp
+        module = imp.load_source('r_in_srtm', MODULE)
+    return module
+
+
+def instrument(srtm, workdir):
+    """Wrap the steps of r.in.srtm to record them in stats"""
+    grass = srtm.grass
+    call = grass.call
+    run_command = grass.run_command
+
+    def cellsize(name):
+        return filesize(os.path.join(workdir, 'cell_' + name))
+
+    def phase_call(args, **kwargs):
+        if args[:2] == ['unzip', '-t']:
+            phase, read, written = 'zip test', filesize(args[2]), 0
+        elif args[0] == 'unzip':
+            phase, read, written = 'unzip', filesize(args[1]), zip_members_size(args[1])
+        else:
+            return call(args, **kwargs)
+        start = timeit.default_timer()
+        result = call(args, **kwargs)
+        stats.add(phase, timeit.default_timer() - start, read, written)
+        return result
+
+    grass.call = phase_call
+
+    def phase_run_command(prog, **kwargs):
+        if prog not in ('r.in.gdal', 'r.in.bin'):
+            return run_command(prog, **kwargs)
+        start = timeit.default_timer()
+        result = run_command(prog, **kwargs)
+        stats.add('import', timeit.default_timer() - start,
+                  filesize(kwargs['input']), cellsize(kwargs['output']))
+        return result
+
+    grass.run_command = phase_run_command
+
+    srtm.zipfile.is_zipfile = timed('zip test', srtm.zipfile.is_zipfile)
+    srtm.shutil.copyfile = timed('copy', srtm.shutil.copyfile,
+                                 read=lambda src, dst: filesize(src),
+                                 written=lambda result, src, dst: filesize(dst))
+    srtm.link_or_copy = timed('copy', srtm.link_or_copy)
+    srtm.extract_member = timed('unzip', srtm.extract_member,
+                                read=lambda zippath, name, target: filesize(zippath),
+                                written=lambda result, zippath, name, target: filesize(target))
+
+    # header and prj files are written with the builtin open()
+    builtin_open = open
+
+    class HeaderFile(object):
+        def __init__(self, path, mode):
+            self.path = path
+            self.start = timeit.default_timer()
+            self.f = builtin_open(path, mode)
+
+        def write(self, data):
+            return self.f.write(data)
+
+        def close(self):
+            self.f.close()
+            stats.add('header', timeit.default_timer() - self.start, 0,
+                      filesize(self.path))
+
+    def phase_open(path, mode='r', *args):
+        if str(path).endswith(('.hdr', '.prj')) and 'w' in mode:
+            return HeaderFile(path, mode)
+        return builtin_open(path, mode, *args)
+
+    srtm.open = phase_open
+
+    if srtm.NATIVE:
+        rows = srtm.TileReader.rows
+
+        def counted_rows(self, *args, **kwargs):
+            for row in rows(self, *args, **kwargs):
+                stats.read['import'] += row.nbytes
+                yield row
+
+        srtm.TileReader.rows = counted_rows
+        srtm.write_raster = timed(
+            'import', srtm.write_raster,
+            written=lambda result, rows, output, *args, **kwargs: cellsize(output))
+
+
+def write_tile(path, kind):
+    """Write a synthetic tile with terrain-like values and some voids"""
+    name, size, nbytes, flags = TILES[kind]
+    if np is not None:
+        y, x = np.mgrid[0:size, 0:size]
+        if nbytes == 2:
+            data = (500 + 300 * np.sin(x / 150.0) * np.cos(y / 200.0)).astype('>i2')
+            data[size // 3:size // 3 + 20, size // 2:size // 2 + 30] = -32768
+        else:
+            data = np.where((x - size // 2) ** 2 + (y - size // 2) ** 2 < (size // 6) ** 2,
+                            255, 0).astype('u1')
+        data.tofile(path)
+        return
+
+    f = open(path, 'wb')
+    try:
+        for row in range(size):
+            if nbytes == 2:
+                values = array('h', [(500 + row + col) % 3000 for col in range(size)])
+                if sys.byteorder == 'little':
+                    values.byteswap()
+            else:
+                values = array('B', [255 if (row // 100 + col // 100) % 7 == 0 else 0
+                                     for col in range(size)])
+            values.tofile(f)
+    finally:
+        f.close()
+
+
+def make_tiles(datadir):
+    """Write the synthetic tiles, each zipped and unzipped
+
+    Returns {(kind, zipped): input name}.
+    """
+    inputs = {}
+    for kind, (name, size, nbytes, flags) in TILES.items():
+        ext = '.raw' if 'w' in flags else '.hgt'
+        kinddir = os.path.join(datadir, kind)
+        os.mkdir(kinddir)
+        plain = os.path.join(kinddir, name + ext)
+        write_tile(plain, kind)
+        zipdir = os.path.join(kinddir, 'zip')
+        os.mkdir(zipdir)
+        archive = zipfile.ZipFile(os.path.join(zipdir, name + ext + '.zip'), 'w',
+                                  zipfile.ZIP_DEFLATED)
+        try:
+            archive.write(plain, name + ext)
+        finally:
+            archive.close()
+        inputs[(kind, False)] = os.path.join(kinddir, name)
+        inputs[(kind, True)] = os.path.join(zipdir, name)
+    return inputs
+
+
+def run_scenario(workdir, infile, flags):
+    """Import infile once with the given r.in.srtm flags, return Stats"""
+    global stats
+    stats = Stats()
+
+    options, defaults = module_defaults()
+    options.update({'input': infile, 'output': 'bench'})
+    parsed_flags = dict((key, key in flags) for key in defaults)
+    make_grass_standin(workdir, (options, parsed_flags))
+
+    srtm = load_module()
+    instrument(srtm, workdir)
+    srtm.options, srtm.flags = srtm.grass.parser()
+    try:
+        srtm.main()
+    finally:
+        srtm.cleanup()
+        shutil.copyfile = copyfile
+        zipfile.is_zipfile = is_zipfile
+        for name in os.listdir(workdir):
+            if name.startswith('cell_'):
+                os.remove(os.path.join(workdir, name))
+    return stats
+
+
+def scenarios():
+    for kind in sorted(TILES):
+        for zipped in (False, True):
+            for mode in ('unzip', 'inproc', 'native'):
+                if mode == 'native' and np is None:
+                    continue
+                if mode == 'unzip' and zipped and not which('unzip'):
+                    continue
+                name = '%s %s %s' % (kind, 'zip' if zipped else 'raw', mode)
+                yield name, kind, zipped, TILES[kind][3] + MODES[mode]
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help="runs per scenario (default: 3)")
+    parser.add_argument('-o', '--output', help="write results as JSON")
+    parser.add_argument('-c', '--compare', help="baseline JSON to compare with")
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+                        help="allowed slowdown against the baseline (default: 0.25)")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='benchmark_r_in_srtm_')
+    results = {}
+    try:
+        datadir = os.path.join(tmpdir, 'data')
+        workdir = os.path.join(tmpdir, 'work')
+        os.mkdir(datadir)
+        os.mkdir(workdir)
+        inputs = make_tiles(datadir)
+
+        print('%-20s' % 'scenario' + ''.join('%20s' % p for p in PHASES) +
+              '%10s' % 'total')
+        print('%-20s' % '' + '%20s' % 'ms / MB r / MB w' * len(PHASES) +
+              '%10s' % 'ms')
+        for name, kind, zipped, flags in scenarios():
+            runs = [run_scenario(workdir, inputs[(kind, zipped)], flags)
+                    for i in range(args.repeat)]
+            best = min(runs, key=Stats.total)
+            total = median([run.total() for run in runs])
+            results[name] = {
+                'total': total,
+                'phases': dict((phase, {'time': best.time[phase],
+                                        'read': best.read[phase],
+                                        'written': best.written[phase]})
+                               for phase in PHASES)}
+            line = '%-20s' % name
+            for phase in PHASES:
+                line += '%20s' % ('%.1f / %.1f / %.1f' % (
+                    best.time[phase] * 1000, best.read[phase] / 1048576.0,
+                    best.written[phase] / 1048576.0))
+            print(line + '%10d' % (total * 1000))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        slower = []
+        for name, result in sorted(results.items()):
+            if name in baseline:
+                ratio = result['total'] / baseline[name]['total']
+                if ratio > 1 + args.tolerance:
+                    slower.append((name, ratio))
+        for name, ratio in slower:
+            print('REGRESSION: %s is %.0f %% slower than the baseline'
+                  % (name, (ratio - 1) * 100))
+        if slower:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
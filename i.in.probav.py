@@ -29,9 +29,9 @@
 #% key: input
 #% type: string
 #% required: yes
-#% multiple: no
+#% multiple: yes
 #% key_desc: name
-#% description: Name of input PROBA-V NDVI .nc file
+#% description: Name of input PROBA-V NDVI .nc file(s), directories or glob patterns
 #% gisprompt: old,file,file
 #%end
 #%option
@@ -40,10 +40,27 @@
 #% required: yes
 #% multiple: no
 #% key_desc: name
-#% description: Name for output raster map
+#% description: Name for output raster map, prefix of the output maps (with the acquisition date) for several input files
 #% gisprompt: new,cell,raster
 #%end
 #%option
+#% key: strds
+#% type: string
+#% required: no
+#% multiple: no
+#% key_desc: name
+#% description: Name of the space time raster dataset to register the output maps in, created if missing
+#% gisprompt: new,stds,strds
+#%end
+#%option
+#% key: nprocs
+#% type: integer
+#% required: no
+#% multiple: no
+#% answer: 1
+#% description: Number of files imported in parallel
+#%end
+#%option
 #% key: scale
 #% type: double
 #% required: no
@@ -61,6 +78,23 @@
 #% key_desc: float
 #% description: Set offset
 #%end
+#%flag
+#% key: r
+#% description: Import only the current region, reading only its part of the file
+#%end
+#%flag
+#% key: i
+#% description: Store the digital numbers as integer map with scale and offset as metadata
+#%end
+#%option
+#% key: view
+#% type: string
+#% required: no
+#% multiple: no
+#% key_desc: name
+#% description: Name for a virtual NDVI raster map, linked to the input file and scaled when read (via a VRT stored with the map in the mapset)
+#% gisprompt: new,cell,raster
+#%end
 #%option
 #% key: memory
 #% type: double
@@ -74,44 +108,368 @@
 
 import sys
 import os
+import re
+import glob
+import math
+import multiprocessing
+import subprocess
+from datetime import datetime
 import atexit
 import grass.script as gscript
-from grass.exceptions import CalledModuleError
+from grass.exceptions import CalledModuleError, ScriptError
+
+global NATIVE
+
+try:
+    import numpy as np
+    from netCDF4 import Dataset, num2date
+    from grass.pygrass.gis.region import Region
+    from grass.pygrass.raster import RasterRow
+    from grass.pygrass.raster.buffer import Buffer
+    NATIVE = True
+except ImportError:
+    NATIVE = False
+
+# null value of CELL maps
+CELL_NULL = -2147483648
+
+VRT = """<VRTDataset rasterXSize="%(cols)d" rasterYSize="%(rows)d">
+  <SRS>EPSG:4326</SRS>
+  <GeoTransform>%(west).15g, %(ewres).15g, 0, %(north).15g, 0, %(nsres).15g</GeoTransform>
+  <VRTRasterBand dataType="Float32" band="1">
+    <NoDataValue>%(nodata)d</NoDataValue>
+    <ComplexSource>
+      <SourceFilename relativeToVRT="0">%(source)s</SourceFilename>
+      <SourceBand>1</SourceBand>
+      <SrcRect xOff="%(xoff)d" yOff="%(yoff)d" xSize="%(cols)d" ySize="%(rows)d"/>
+      <DstRect xOff="0" yOff="0" xSize="%(cols)d" ySize="%(rows)d"/>
+      %(scaling)s
+    </ComplexSource>
+  </VRTRasterBand>
+</VRTDataset>
+"""
 
 def cleanup():
     pass
 
 
-def main():
+def ndvi_variable(dataset):
+    """Return the NDVI variable of a NetCDF dataset
 
-    global tmpfile
-    infile = options['input']
-    out = options['output']
-    scale = options['scale']
-    offset = options['offset']
-    mem = options['memory']
+    The variable NDVI, or else the first variable with at least two
+    dimensions.
+    """
+    if 'NDVI' in dataset.variables:
+        return dataset.variables['NDVI']
+    for variable in dataset.variables.values():
+        if variable.ndim >= 2:
+            return variable
+    gscript.fatal(("No NDVI variable found"))
 
 
-    pid = os.getpid()
-    tmpname = str(pid) + 'i.in.probav'
-    tmpfile = gscript.tempfile()
+def region_window(north, west, nsres, ewres, nrows, ncols, region):
+    """Return the rows and columns of a grid overlapping a region
 
-    if not gscript.overwrite() and gscript.find_file(out)['file']:
-        gscript.fatal(("<%s> already exists. Aborting.") % out)
+    north and west are the outer edges of the grid. Returns
+    (row_start, row_stop, col_start, col_stop), rows counted from the
+    north; the window is empty if the grid does not overlap the region.
+    """
+    # snap to the grid, the region edges need not be aligned
+    eps = 1e-6
+    row_start = max(0, int(math.floor((north - float(region['n'])) / nsres + eps)))
+    row_stop = min(nrows, int(math.ceil((north - float(region['s'])) / nsres - eps)))
+    col_start = max(0, int(math.floor((float(region['w']) - west) / ewres + eps)))
+    col_stop = min(ncols, int(math.ceil((float(region['e']) - west) / ewres - eps)))
+    return (row_start, max(row_start, row_stop), col_start, max(col_start, col_stop))
 
-    # Are we in LatLong location?
-    s = gscript.read_command("g.proj", flags='j')
-    kv = gscript.parse_key_val(s)
-    if kv['+proj'] != 'longlat':
-        gscript.fatal(("This module only operates in LatLong locations"))
+
+def coordinate_resolution(dataset, name, values, axis):
+    """Return the cell size along the coordinate variable name
+
+    From the spacing of the cell centres values; for a single cell from
+    the bounds variable of the coordinate or from the
+    geospatial_<axis>_resolution attribute of the file. Returns None if
+    it is unknown.
+    """
+    if len(values) > 1:
+        return abs(values[-1] - values[0]) / (len(values) - 1)
+    bounds = getattr(dataset.variables[name], 'bounds', None)
+    if bounds in dataset.variables:
+        edges = dataset.variables[bounds][:].astype(np.float64).ravel()
+        return abs(edges[-1] - edges[0])
+    resolution = getattr(dataset, 'geospatial_%s_resolution' % axis, None)
+    try:
+        # e.g. "0.00297619047619 degree"
+        return abs(float(str(resolution).split()[0]))
+    except (IndexError, ValueError):
+        return None
+
+
+def import_native(infile, out, scale, offset, mem, region=None, dn=False):
+    """Import the NDVI of a NetCDF file in one pass
+
+    The digital numbers are read in blocks of rows fitting into mem MB,
+    converted to NDVI = scale * DN + offset with the fill value and the
+    values outside of the valid range as null, and written directly into
+    the FCELL map out; with dn, the digital numbers are written into the
+    CELL map out instead. With region, only the hyperslab of the file
+    overlapping the region is read and imported.
+
+    Returns the grid of the imported window, for write_view(); None
+    without import if the resolution of a single row or column file is
+    unknown.
+    """
+    dataset = Dataset(infile)
+    try:
+        variable = ndvi_variable(dataset)
+        variable.set_auto_maskandscale(False)
+        # the variable is no longer valid once the dataset is closed
+        name = variable.name
+        lat_name, lon_name = variable.dimensions[-2:]
+        lat = dataset.variables[lat_name][:].astype(np.float64)
+        lon = dataset.variables[lon_name][:].astype(np.float64)
+        nrows, ncols = len(lat), len(lon)
+
+        # lat and lon are the cell centres, the rows may run south to north
+        nsres = coordinate_resolution(dataset, lat_name, lat, 'lat')
+        ewres = coordinate_resolution(dataset, lon_name, lon, 'lon')
+        if not nsres or not ewres:
+            return None
+        flip = lat[0] < lat[-1]
+        north = lat.max() + nsres / 2
+        west = lon.min() - ewres / 2
+        if region:
+            row_start, row_stop, col_start, col_stop = region_window(
+                north, west, nsres, ewres, nrows, ncols, region)
+            if row_start == row_stop or col_start == col_stop:
+                gscript.fatal(("<%s> does not overlap the current region") % infile)
+        else:
+            row_start, row_stop, col_start, col_stop = 0, nrows, 0, ncols
+
+        window = Region()
+        window.north = north - row_start * nsres
+        window.south = north - row_stop * nsres
+        window.west = west + col_start * ewres
+        window.east = west + col_stop * ewres
+        window.rows = row_stop - row_start
+        window.cols = col_stop - col_start
+        window.adjust(rows=True, cols=True)
+        window.set_raster_region()
+
+        fill = getattr(variable, '_FillValue', None)
+        valid_range = getattr(variable, 'valid_range', None)
+        # leading dimensions, e.g. time, have a single step
+        lead = (0,) * (variable.ndim - 2)
+        # DN and NDVI of a block of rows
+        block = max(1, int(float(mem) * 2 ** 20 / ((col_stop - col_start) * 8)))
+        cols = slice(col_start, col_stop)
+
+        if dn:
+            mtype = 'CELL'
+        else:
+            mtype = 'FCELL'
+        buf = Buffer((col_stop - col_start,), mtype=mtype)
+        raster = RasterRow(out)
+        raster.open('w', mtype=mtype, overwrite=gscript.overwrite())
+        try:
+            for start in range(row_start, row_stop, block):
+                stop = min(row_stop, start + block)
+                if flip:
+                    values = variable[lead + (slice(nrows - stop, nrows - start), cols)][::-1]
+                else:
+                    values = variable[lead + (slice(start, stop), cols)]
+                null = np.zeros(values.shape, dtype=bool)
+                if fill is not None:
+                    null |= values == fill
+                if valid_range is not None:
+                    null |= (values < valid_range[0]) | (values > valid_range[1])
+                if dn:
+                    rows = values.astype(np.int32)
+                    rows[null] = CELL_NULL
+                else:
+                    rows = values.astype(np.float32) * scale + offset
+                    rows[null] = np.nan
+                for row in rows:
+                    buf[:] = row
+                    raster.put_row(buf)
+        finally:
+            raster.close()
+    finally:
+        dataset.close()
+
+    return dict(variable=name, north=window.north, west=window.west,
+                nsres=nsres, ewres=ewres, row_start=row_start,
+                col_start=col_start, rows=row_stop - row_start,
+                cols=col_stop - col_start, fill=fill, valid_range=valid_range)
+
+
+def write_metadata(out, scale, offset, fill):
+    """Record scale, offset and fill value of the DN map out as metadata"""
+    history = 'scale=%s offset=%s' % (scale, offset)
+    if fill is not None:
+        history += ' fill=%s' % fill
+    gscript.run_command('r.support', map=out, units='DN',
+                        description='NDVI = %s * DN + %s' % (scale, offset),
+                        history=history)
 
 
+def dn_colors(out, scale, offset):
+    """Set the NDVI color table on the DN map out, in digital numbers"""
+    path = os.path.join(os.environ.get('GISBASE', ''), 'etc', 'colors', 'ndvi')
+    if not os.path.isfile(path):
+        gscript.run_command('r.colors', map=out, color='grey')
+        return
+    rules = []
+    with open(path) as fd:
+        for line in fd:
+            fields = line.split()
+            try:
+                value = float(fields[0])
+            except (IndexError, ValueError):
+                # nv, default, percentages
+                rules.append(line.strip())
+                continue
+            rules.append('%s %s' % ((value - offset) / scale, ' '.join(fields[1:])))
+    gscript.write_command('r.colors', map=out, rules='-', stdin='\n'.join(rules))
+
+
+def write_view(infile, view, scale, offset, grid):
+    """Link a virtual NDVI map to the NetCDF file
+
+    A GDAL VRT of the imported window of the NDVI variable converts the
+    digital numbers to NDVI when it is read, with the fill value and the
+    values outside of the valid range as nodata. It is written into
+    cell_misc/<view> of the current mapset, so it is removed together
+    with the map, and linked as view with r.external.
+    """
+    env = gscript.gisenv()
+    directory = os.path.join(env['GISDBASE'], env['LOCATION_NAME'],
+                             env['MAPSET'], 'cell_misc', view)
+    vrt = os.path.join(directory, 'ndvi.vrt')
+
+    nodata = -9999
+    if grid['valid_range'] is not None:
+        low, high = [float(v) for v in grid['valid_range']]
+        # linear between the valid DN, nodata outside
+        scaling = '<LUT>%g:%d,%g:%d,%g:%.15g,%g:%.15g,%g:%d,%g:%d</LUT>' % (
+            low - 1, nodata, low - 0.5, nodata, low, low * scale + offset,
+            high, high * scale + offset, high + 0.5, nodata, high + 1, nodata)
+    else:
+        scaling = '<ScaleOffset>%.15g</ScaleOffset><ScaleRatio>%.15g</ScaleRatio>' % (offset, scale)
+    if grid['fill'] is not None:
+        scaling += '<NODATA>%s</NODATA>' % grid['fill']
+
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(vrt, 'w') as fd:
+            fd.write(VRT % dict(
+                cols=grid['cols'], rows=grid['rows'], west=grid['west'],
+                ewres=grid['ewres'], north=grid['north'], nsres=-grid['nsres'],
+                nodata=nodata, source='NETCDF:"%s":%s' % (os.path.abspath(infile), grid['variable']),
+                xoff=grid['col_start'], yoff=grid['row_start'], scaling=scaling))
+    except (IOError, OSError) as e:
+        gscript.fatal(("Unable to write the VRT of the virtual NDVI map <%s>: %s") % (view, e))
+    gscript.run_command('r.external', input=vrt, output=view, flags='o',
+                        overwrite=gscript.overwrite(), quiet=True)
+    gscript.run_command('r.colors', map=view, color='ndvi')
+
+
+def expand_input(input):
+    """Expand comma separated files, glob patterns and directories
+
+    Returns the NetCDF files in input order, each file only once.
+    """
+    infiles = []
+    for item in input.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if os.path.isdir(item):
+            names = [os.path.join(item, name) for name in sorted(os.listdir(item))
+                     if name.lower().endswith('.nc')]
+        elif any(c in item for c in '*?['):
+            names = sorted(glob.glob(item))
+        else:
+            names = [item]
+        for name in names:
+            if name not in infiles:
+                infiles.append(name)
+    return infiles
+
+
+def acquisition_date(infile):
+    """Return the acquisition date of a PROBA-V file, None if unknown
+
+    From the time_coverage_start attribute or the time variable of the
+    file, else from the first date (YYYYMMDD) in the file name.
+    """
+    if NATIVE:
+        dataset = Dataset(infile)
+        try:
+            start = getattr(dataset, 'time_coverage_start', None)
+            if start:
+                match = re.match(r'(\d{4})-?(\d{2})-?(\d{2})', start)
+                if match:
+                    return datetime(*[int(v) for v in match.groups()])
+            if 'time' in dataset.variables:
+                time = dataset.variables['time']
+                if getattr(time, 'units', None):
+                    date = num2date(time[0], time.units,
+                                    getattr(time, 'calendar', 'standard'))
+                    return datetime(date.year, date.month, date.day)
+        finally:
+            dataset.close()
+    for match in re.finditer(r'(?<!\d)((?:19|20)\d{6})', os.path.basename(infile)):
+        try:
+            return datetime.strptime(match.group(1), '%Y%m%d')
+        except ValueError:
+            continue
+    return None
+
+
+def import_file(infile, out, scale, offset, mem, region=None, dn=False,
+                view=None):
+    """Import one PROBA-V file as NDVI map out (DN map with dn)"""
+    if NATIVE:
+        gscript.message('Importing raster map <' + out + '>...')
+        grid = import_native(infile, out, float(scale), float(offset), mem,
+                             region, dn)
+        if grid is not None:
+            if dn:
+                write_metadata(out, scale, offset, grid['fill'])
+                dn_colors(out, float(scale), float(offset))
+            else:
+                gscript.run_command('r.colors', map=out, color='ndvi')
+            if view:
+                write_view(infile, view, float(scale), float(offset), grid)
+                gscript.message(("Done: generated virtual NDVI map <%s>") % view)
+            gscript.message(("Done: generated map <%s>") % out)
+            return
+        gscript.warning(("Resolution of <%s> unknown, importing with r.in.gdal") % infile)
+        if view:
+            gscript.warning(("No virtual NDVI map <%s> for <%s>") % (view, infile))
+
+    tmpname = str(os.getpid()) + 'i.in.probav'
     try:
         gscript.message('Importing raster map <' + out + '>...')
-        gscript.run_command('r.in.gdal', input=infile, output=tmpname, memory=mem, quiet=True)
+        if region:
+            gdal_flags = 'r'
+        else:
+            gdal_flags = ''
+        gscript.run_command('r.in.gdal', input=infile, output=tmpname, memory=mem,
+                            flags=gdal_flags, quiet=True)
     except CalledModuleError:
         gscript.fatal(("An error occurred. Stop."))
 
+    if dn:
+        gscript.run_command('g.rename', raster=(tmpname, out), overwrite=gscript.overwrite(),
+                            quiet=True)
+        write_metadata(out, scale, offset, None)
+        dn_colors(out, float(scale), float(offset))
+        gscript.message(("Done: generated map <%s>") % out)
+        return
+
     # What is the relation between the digital number and the real NDVI ?
     # Real NDVI =coefficient a * Digital Number + coefficient b
     #           = a * DN +b
@@ -129,11 +487,144 @@ def main():
 
     # remove original input
     gscript.run_command('g.remove', type='raster', name=tmpname, quiet=True, flags='f')
+    gscript.del_temp_region()
     # set color table to ndvi
     gscript.run_command('r.colors', map=out, color='ndvi')
 
     gscript.message(("Done: generated map <%s>") % out)
 
+
+def import_file_worker(args):
+    """Import one file, returning an error message instead of exiting
+
+    args are the keyword arguments of import_file(). gscript.fatal()
+    raises here, so a broken file is reported by main() together with
+    the others instead of ending the import.
+    """
+    infile, out = args['infile'], args['out']
+    raise_on_error = gscript.get_raise_on_error()
+    gscript.set_raise_on_error(True)
+    try:
+        import_file(**args)
+    except (ScriptError, CalledModuleError, IOError, OSError, ValueError,
+            AttributeError, RuntimeError) as e:
+        # RuntimeError: netCDF4 and GDAL failing to read the file
+        return (infile, out, str(e))
+    finally:
+        gscript.set_raise_on_error(raise_on_error)
+    return (infile, out, None)
+
+
+def register_strds(strds, maps):
+    """Register maps, a list of (map, date), in strds in one call
+
+    The space time raster dataset is created if it does not exist.
+    """
+    try:
+        gscript.read_command('t.info', input=strds, type='strds', flags='g',
+                             quiet=True, stderr=subprocess.PIPE)
+    except CalledModuleError:
+        gscript.run_command('t.create', output=strds, type='strds',
+                            temporaltype='absolute', semantictype='mean',
+                            title='PROBA-V NDVI',
+                            description='PROBA-V NDVI imported by i.in.probav',
+                            quiet=True)
+
+    listfile = gscript.tempfile()
+    with open(listfile, 'w') as fd:
+        for name, date in maps:
+            fd.write('%s|%s\n' % (name, date.strftime('%Y-%m-%d')))
+    try:
+        gscript.run_command('t.register', input=strds, file=listfile,
+                            type='raster', quiet=True)
+    finally:
+        gscript.try_remove(listfile)
+
+
+def main():
+
+    global tmpfile
+    infiles = expand_input(options['input'])
+    out = options['output']
+    scale = options['scale']
+    offset = options['offset']
+    mem = options['memory']
+    nprocs = int(options['nprocs'])
+    if flags['r']:
+        region = gscript.region()
+    else:
+        region = None
+    if not infiles:
+        gscript.fatal(("No input files found"))
+
+    tmpfile = gscript.tempfile()
+
+    # Are we in LatLong location?
+    s = gscript.read_command("g.proj", flags='j')
+    kv = gscript.parse_key_val(s)
+    if kv['+proj'] != 'longlat':
+        gscript.fatal(("This module only operates in LatLong locations"))
+
+    if options['view'] and not NATIVE:
+        gscript.fatal(("A virtual NDVI map requires NumPy, netCDF4 and pygrass"))
+
+    jobs = []
+    dates = {}
+    for infile in infiles:
+        date = acquisition_date(infile)
+        if options['strds'] and date is None:
+            gscript.fatal(("No acquisition date found for <%s>") % infile)
+        if len(infiles) == 1:
+            suffix = ''
+        elif date is not None:
+            suffix = '_' + date.strftime('%Y%m%d')
+        else:
+            suffix = '_' + re.sub(r'\W', '_', os.path.splitext(os.path.basename(infile))[0])
+        tileout = out + suffix
+        if tileout in dates:
+            gscript.fatal(("<%s> and <%s> have the same acquisition date") %
+                          (dates[tileout][0], infile))
+        dates[tileout] = (infile, date)
+        if not gscript.overwrite() and gscript.find_file(tileout)['file']:
+            gscript.fatal(("<%s> already exists. Aborting.") % tileout)
+        if options['view']:
+            view = options['view'] + suffix
+        else:
+            view = None
+        jobs.append(dict(infile=infile, out=tileout, scale=scale, offset=offset,
+                         mem=mem, region=region, dn=flags['i'], view=view))
+
+    if nprocs > 1 and len(jobs) > 1:
+        gscript.message(("Importing %d files with %d processes...") %
+                        (len(jobs), nprocs))
+        pool = multiprocessing.Pool(min(nprocs, len(jobs)))
+        try:
+            results = pool.map(import_file_worker, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [import_file_worker(job) for job in jobs]
+
+    failed = [(infile, error) for infile, tileout, error in results if error]
+    for infile, error in failed:
+        gscript.warning(("File <%s> not imported: %s") % (infile, error))
+
+    imported = [tileout for infile, tileout, error in results if not error]
+    if options['strds'] and imported:
+        gscript.message(("Registering %d maps in <%s>...") %
+                        (len(imported), options['strds']))
+        register_strds(options['strds'],
+                       [(tileout, dates[tileout][1]) for tileout in imported])
+
+    # summary
+    if len(jobs) > 1:
+        gscript.message(("Imported %d of %d files") %
+                        (len(jobs) - len(failed), len(jobs)))
+    if failed:
+        gscript.fatal(("%d of %d files could not be imported") %
+                      (len(failed), len(jobs)))
+
     return 0
 
 if __name__ == "__main__":
@@ -23,10 +23,12 @@
 #% keyword: Raster, Import
 #%end
 #%option G_OPT_F_INPUT
-#% description: Name of input ALOS World 3D file
+#% multiple: yes
+#% description: Name of input ALOS World 3D file(s)
 #%end
 #%option G_OPT_R_OUTPUT
-#% description: Name of output file
+#% required: no
+#% description: Name of output file, prefix of the output maps for several input files
 #%end
 #%option
 #% key: username_jaxa
@@ -88,6 +90,124 @@
 #% description: value of dataholes
 #% answer: -9999
 #%end
+#%option G_OPT_F_INPUT
+#% key: msk
+#% required: no
+#% multiple: yes
+#% description: Name of the AW3D mask (MSK) file of each input tile, to find the voids
+#%end
+#%option
+#% key: msk_values
+#% type: integer
+#% required: no
+#% multiple: yes
+#% description: Values of the mask file to fill (1: cloud and snow), in addition to the hole value
+#% answer: 1
+#%end
+#%option G_OPT_M_DIR
+#% key: srtm_dir
+#% required: no
+#% description: Directory of local SRTM HGT tiles (.hgt or .hgt.zip) to use instead of r.in.srtm.region
+#%end
+#%option
+#% key: srtm_cache
+#% type: integer
+#% required: no
+#% multiple: no
+#% description: Number of decoded SRTM tiles kept in memory per process (engine=numpy)
+#% answer: 9
+#%end
+#%option
+#% key: engine
+#% type: string
+#% required: no
+#% multiple: no
+#% options: grass,numpy
+#% descriptions: grass;Chain of GRASS modules with r.resamp.bspline;numpy;In memory with NumPy, writes only the output map
+#% description: Engine for filling the dataholes
+#% answer: grass
+#%end
+#%option
+#% key: method
+#% type: string
+#% required: no
+#% multiple: no
+#% options: auto,points,delta
+#% descriptions: auto;Chosen per tile from its voids, with random and memory (see -p);points;Interpolate the voids from the buffer cells and random SRTM points;delta;SRTM plus the AW3D-SRTM offset interpolated from the 2 px ring around the voids
+#% description: Method for filling the dataholes
+#% answer: points
+#%end
+#%flag
+#% key: c
+#% description: Fill each void cluster separately, windowed to its bounding box (engine=numpy)
+#%end
+#%option
+#% key: sampling
+#% type: string
+#% required: no
+#% multiple: no
+#% options: random,stratified
+#% descriptions: random;Random cells of each void (like r.random);stratified;One cell per stratum of an even grid over each void (implies -c)
+#% description: Sampling of the SRTM points (engine=numpy)
+#% answer: random
+#%end
+#%option
+#% key: ring
+#% type: integer
+#% required: no
+#% multiple: no
+#% description: Width in cells of a ring around each void, beyond the 2 cell buffer, to also draw SRTM points from (engine=numpy)
+#% answer: 0
+#%end
+#%option
+#% key: max_points
+#% type: integer
+#% required: no
+#% multiple: no
+#% description: Maximum number of SRTM points per void, 0 for no limit (engine=numpy)
+#% answer: 0
+#%end
+#%option
+#% key: seed
+#% type: integer
+#% required: no
+#% multiple: no
+#% description: Seed of the random sampling (engine=numpy)
+#% answer: 1
+#%end
+#%option
+#% key: halo
+#% type: integer
+#% required: no
+#% multiple: no
+#% description: Width in cells of the border read from the neighbouring input tiles, to fill voids across tile borders (engine=numpy)
+#% answer: 0
+#%end
+#%option G_OPT_M_DIR
+#% key: checkpoint
+#% required: no
+#% description: Directory for the manifests of the runs, to resume them with -r
+#%end
+#%flag
+#% key: r
+#% description: Resume the runs from their manifests, skipping completed tiles and stages
+#%end
+#%option
+#% key: nprocs
+#% type: integer
+#% required: no
+#% multiple: no
+#% description: Number of processes filling the input tiles, or the void clusters of one tile (engine=numpy, implies -c), in parallel
+#% answer: 1
+#%end
+#%flag
+#% key: p
+#% description: Print the void statistics and the planned settings of each tile as JSON and exit
+#%end
+#%rules
+#% requires: -r,checkpoint
+#% required: output,-p
+#%end
 
 proj = ''.join([
     'GEOGCS[',
@@ -105,7 +225,14 @@ import atexit
 import urllib
 import urllib2
 import time
+import json
+import math
+import hashlib
+import multiprocessing
+import zipfile
+from collections import OrderedDict
 from cookielib import CookieJar
+from grass.exceptions import CalledModuleError, ScriptError
 
 global GDAL
 
@@ -119,6 +246,24 @@ except ImportError:
     except ImportError:
         GDAL = False
         print('WARNING: Python GDAL library not found, please install it')
+
+global NUMPY
+
+try:
+    import numpy as np
+    from grass.script import array as garray
+    NUMPY = True
+except ImportError:
+    NUMPY = False
+
+global SCIPY
+
+try:
+    from scipy import interpolate as sinterpolate
+    from scipy import ndimage
+    SCIPY = True
+except ImportError:
+    SCIPY = False
         
 def check(home):
     # check if the folder is writeable
@@ -129,119 +274,963 @@ def check(home):
                       "exist or is not writeable"))
             
         
-def grass_commands(input, username_srtm, password_srtm, random, value, output, memory):
+# prefix of the temporary maps of all runs of this process
+run_prefix = 'tmp_aw3d_%d' % os.getpid()
+# runs whose temporary maps are removed at exit
+temp_runs = []
+
+
+def cleanup():
+    for run in temp_runs:
+        remove_temp_maps(run)
+
+
+def resumable_run(output):
+    """Return the run of a resumable run writing output
+
+    The run must be the same when resuming, and unique to output: the
+    names of the maps of one output must not be the names of another,
+    e.g. of dem and dem_buffer, so the output name is hashed.
+    """
+    return 'tmp_aw3d_%s' % hashlib.md5(output.encode('utf-8')).hexdigest()[:16]
+
+
+def temp_maps(run):
+    """Return the names of the temporary maps of a run
+
+    run is a prefix unique to the run, so that runs can share a mapset.
+    """
+    names = ('jaxa_patch', 'msk_patch', 'srtm_patch', 'mask', 'buffer_mask',
+             'srtm_void', 'random_points', 'fill_input', 'fill_data',
+             'delta_input', 'delta_fill')
+    return dict((name, '%s_%s' % (run, name)) for name in names)
+
+
+def remove_maps(names):
+    """Remove the raster maps of names that exist in the current mapset"""
+    names = [name for name in names
+             if grass.find_file(name, element='cell', mapset='.')['file']]
+    if names:
+        grass.run_command("g.remove", flags = "f", type = "raster",
+                          name = ','.join(names), quiet = True)
+
+
+def remove_temp_maps(run):
+    """Remove the temporary maps of a run, by their exact names"""
+    remove_maps(sorted(temp_maps(run).values()))
+
+
+class Manifest(object):
+    """Completed stages of a run with their output maps, to resume the run
+
+    The manifest is a JSON file written after each stage; without path
+    nothing is recorded. A manifest of a run with other params is not
+    resumed.
+    """
+    def __init__(self, path=None, params=None, resume=False):
+        self.path = path
+        self.resume = bool(path and resume)
+        self.state = dict(params=params or {}, stages={}, done=False)
+        if path and resume and os.path.isfile(path):
+            with open(path) as fd:
+                state = json.load(fd)
+            if state['params'] == self.state['params']:
+                self.state = state
+            else:
+                grass.warning(_("Parameters of <%s> changed, not resuming") % path)
+
+    def overwrite(self):
+        """Return whether the output of the run may be replaced
+
+        With --o, or when resuming: the interrupted run may have written
+        the output already.
+        """
+        return grass.overwrite() or self.resume
+
+    def finished(self):
+        """Return whether the run was completed"""
+        return self.state['done']
+
+    def completed(self, stage):
+        """Return whether stage was completed and its maps still exist"""
+        if stage not in self.state['stages']:
+            return False
+        for name in self.state['stages'][stage]:
+            if not grass.find_file(name, element='cell')['file']:
+                return False
+        grass.message(_("Resuming after stage <%s>") % stage)
+        return True
+
+    def complete(self, stage, maps=()):
+        """Record stage with its output maps"""
+        self.state['stages'][stage] = list(maps)
+        self.save()
+
+    def finish(self):
+        """Record the completion of the run"""
+        self.state['stages'] = {}
+        self.state['done'] = True
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        # replace the manifest atomically, it must survive a kill
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fd:
+            json.dump(self.state, fd, indent=1)
+        os.rename(tmp, self.path)
+
+
+def grass_commands(input, username_srtm, password_srtm, random, value, output, memory,
+                   method='points', msk=None, msk_values=None, run='tmp_aw3d',
+                   srtm_dir=None, manifest=None):
 #run the grass commands
-    grass.run_command("r.in.gdal", 
-                      input = input, 
-                      output = output, 
-                      memory = memory)
-    grass.run_command("g.rename",
-                      raster = output,"jaxa_patch")
+# the dataholes are selected by the mask map of this run in the expressions
+# instead of the mapset wide MASK, all maps are named after the run
+# each stage is recorded in the manifest and skipped when resuming; the maps
+# of a failed run are kept for resuming if the manifest is stored
+    maps = temp_maps(run)
+    maps['output'] = output
+    if manifest is None:
+        manifest = Manifest()
+    finished = False
+    grass.use_temp_region()
+    try:
+        if not manifest.completed('import'):
+            imported = [maps['jaxa_patch']]
+            grass.run_command("r.in.gdal",
+                              input = input,
+                              output = maps['jaxa_patch'],
+                              memory = memory,
+                              overwrite = True)
+            if msk:
+                grass.run_command("r.in.gdal",
+                                  input = msk,
+                                  output = maps['msk_patch'],
+                                  memory = memory,
+                                  overwrite = True)
+                imported.append(maps['msk_patch'])
+            manifest.complete('import', imported)
 
-    grass.run_command("g.region",
-                      raster = "jaxa_patch")
+# the dataholes: the hole value and the MSK values
+        holes = "%s==%d" % (maps['jaxa_patch'], int(value))
+        if msk:
+            holes += "".join(" || %s==%d" % (maps['msk_patch'], int(v))
+                             for v in msk_values)
+
+        grass.run_command("g.region",
+                          raster = maps['jaxa_patch'])
 
 #TODO 2 passwoerter, kommandozeile nicht unbedingt sicher, optional siehe r.modis.download 
-    grass.run_command("r.in.srtm.region",
-                      user = username_srtm,
-                      password = password_srtm,
-                      flags = 1,
-                      output = 'srtm_patch')
+        if not manifest.completed('srtm'):
+            if srtm_dir:
+                import_srtm(srtm_dir, maps, run)
+            else:
+                grass.run_command("r.in.srtm.region",
+                                  user = username_srtm,
+                                  password = password_srtm,
+                                  flags = 1,
+                                  output = maps['srtm_patch'],
+                                  overwrite = True)
+            manifest.complete('srtm', [maps['srtm_patch']])
+
+# mask calculation to show dataholes, computed once
+        if not manifest.completed('mask'):
+            grass.run_command("r.mapcalc",
+                              expression = "%s = if(%s,1,null())" % (maps['mask'], holes),
+                              overwrite = True)
+            manifest.complete('mask', [maps['mask']])
+
+# buffer around mask (2 px): 1 inside the dataholes, 2 on the ring
+        if not manifest.completed('buffer'):
+            grass.run_command("r.grow",
+                              input = maps['mask'],
+                              output = maps['buffer_mask'],
+                              radius = 2.01,
+                              new = 2,
+                              overwrite = True)
+            manifest.complete('buffer', [maps['buffer_mask']])
+
+        if method == 'delta':
+            delta_commands(maps, memory, manifest)
+        else:
+            points_commands(maps, random, memory, manifest)
+        finished = True
+    finally:
+        if finished or not manifest.path:
+            remove_temp_maps(run)
+        grass.del_temp_region()
+    manifest.finish()
+
+
+def fill_mask(input, output, mask, memory):
+    """Interpolate the cells of mask from the cells of input (bilinear)
+
+    Like r.fillnulls method=bilinear, but only the cells of the mask map
+    of the run are interpolated, not every null cell of the region.
+    """
+    region = grass.region()
+    grass.run_command("r.resamp.bspline",
+                      input = input,
+                      output = output,
+                      mask = mask,
+                      method = "bilinear",
+                      ew_step = 3 * region['ewres'],
+                      ns_step = 3 * region['nsres'],
+                      lambda_ = 0.01,
+                      memory = memory,
+                      flags = 'n',
+                      quiet = True,
+                      overwrite = True)
+
+
+def points_commands(maps, random, memory, manifest):
+    """Fill the dataholes from random SRTM points
+
+    Continues grass_commands() after the buffer: the dataholes are
+    interpolated from the 2 px ring of AW3D cells around them and the
+    random points inside. maps are the names of the maps of the run and
+    the output.
+    """
+# random points from srtm data inside the dataholes
+    if not manifest.completed('points'):
+        grass.run_command("r.mapcalc",
+                          expression = "%(srtm_void)s = if(isnull(%(mask)s),null(),%(srtm_patch)s)" % maps,
+                          overwrite = True)
+
+        grass.run_command("r.random",
+                          input = maps['srtm_void'],
+                          npoints = random + "%",
+                          raster = maps['random_points'],
+                          overwrite = True)
+
+# jaxa data on the ring, random points inside, null elsewhere
+        grass.run_command("r.mapcalc",
+                          expression = "%(fill_input)s = if(%(buffer_mask)s==2,%(jaxa_patch)s,%(random_points)s)" % maps,
+                          overwrite = True)
+        manifest.complete('points', [maps['fill_input']])
+
+#fill the dataholes from the random points and the ring of jaxa data
+    if not manifest.completed('fill'):
+        grass.message(("filling null values of %s") % maps['output'])
+        fill_mask(maps['fill_input'], maps['fill_data'], maps['mask'], memory)
+        manifest.complete('fill', [maps['fill_data']])
 
-# mask calculation to show dataholes
     grass.run_command("r.mapcalc",
-                      expression = "mask = if(jaxa_patch==-9999,1,null())")
+                      expression = "%(output)s = if(isnull(%(mask)s),%(jaxa_patch)s,%(fill_data)s)" % maps,
+                      overwrite = manifest.overwrite())
 
-    grass.run_command("g.region",
-                      raster = "mask")
 
-# buffer around mask (2 px)
-    grass.run_command("r.buffer",
-                      input = "mask",
-                      output = "buffer_mask",
-                      distances = 60,
-                      units = "meters")
+def delta_commands(maps, memory, manifest):
+    """Fill the dataholes with SRTM plus the interpolated AW3D-SRTM offset
 
-    grass.run_command("g.region",
-                      raster = "buffer_mask")
+    Continues grass_commands() after the buffer: the offset is known on
+    the 2 px ring around the voids only, so the interpolation solves for
+    the ring differences instead of thousands of random points. maps are
+    the names of the maps of the run and the output.
+    """
+# AW3D-SRTM offset on the ring of the dataholes
+    if not manifest.completed('delta'):
+        grass.run_command("r.mapcalc",
+                          expression = "%(delta_input)s = if(%(buffer_mask)s==2,%(jaxa_patch)s-%(srtm_patch)s,null())" % maps,
+                          overwrite = True)
+        manifest.complete('delta', [maps['delta_input']])
+
+    if not manifest.completed('fill'):
+        grass.message(("filling null values of %s") % maps['output'])
+        fill_mask(maps['delta_input'], maps['delta_fill'], maps['mask'], memory)
+        manifest.complete('fill', [maps['delta_fill']])
 
-# mapcalc for buffer fill with Values from jaxa data
     grass.run_command("r.mapcalc",
-                      expression = "buffer_fill = if(buffer_mask==2,jaxa_patch,null())")
-
-    grass.run_command("r.mask",
-                      raster = "jaxa_patch",
-                      maskcats = value)
-
-#set region to srtm
-    grass.run_command("g.region",
-                      raster = "srtm_patch")
-
-# random points from srtm data
-#   DONE  TODO Werte oben definieren, das man sie als Variablen nutzen kann
-    grass.run_command("r.random",
-                      input = "srtm_patch",
-                      npoints = random + "%",
-                      raster = "random_points")
-
-# deactivate mask
-    grass.run_command("r.mask",
-                      flags = 'r')
-
-    grass.run_command("g.region",
-                      raster = "random_points,buffer_fill")
-
-# patch of random points with filled buffer zone
-    grass.run_command("r.patch",
-                      input = "random_points,buffer_fill",
-                      output = "patch_random_buffer")
-
-    grass.run_command("g.region",
-                      raster = "jaxa_patch")
-#  DONE  TODO Werte oben definieren, das man sie als Variablen nutzen kann
-# generate mask again
-
-    grass.run_command("r.mask",
-                      raster = "jaxa_patch",
-                      maskcats = value,
-                      quiet = True)
-
-    grass.run_command("g.region",
-                      raster = "patch_random_buffer")
-
-#fill nulls
-    grass.run_command("r.fillnulls",
-                      input = "patch_random_buffer",
-                      output = "fill_data",
-                      method = "bilinear",
-                      quiet = True)
-    grass.message(("filling null values of %s") % output)
+                      expression = "%(output)s = if(isnull(%(mask)s),%(jaxa_patch)s,%(srtm_patch)s+%(delta_fill)s)" % maps,
+                      overwrite = manifest.overwrite())
+
 
-# deactivate mask again
-    grass.run_command("r.mask",
-                      flags = 'r',
-                      quiet = True)
+def open_raster(input):
+    """Open a raster file with GDAL, return the dataset and its bounds
 
-    grass.run_command("g.region",
-                      raster = "jaxa_patch")
+    The bounds are a dict for g.region.
+    """
+    dataset = gdal.Open(input)
+    if dataset is None:
+        grass.fatal(_("Unable to open <%s>") % input)
+    transform = dataset.GetGeoTransform()
+    rows = dataset.RasterYSize
+    cols = dataset.RasterXSize
+    bounds = dict(n=transform[3], s=transform[3] + transform[5] * rows,
+                  w=transform[0], e=transform[0] + transform[1] * cols,
+                  rows=rows, cols=cols)
+    return dataset, bounds
 
-# set values to null() to generate "real" holes
-    grass.run_command("r.null",
-                      map = "jaxa_patch",
-                      setnull = value)
 
-    grass.run_command("g.region",
-                      raster = "jaxa_patch,fill_data")
+def tile_bounds(input):
+    """Return the bounds of a raster file"""
+    dataset, bounds = open_raster(input)
+    dataset = None
+    return bounds
+
+
+def grow_bounds(bounds, halo):
+    """Return bounds grown by halo cells on each side"""
+    nsres = (bounds['n'] - bounds['s']) / bounds['rows']
+    ewres = (bounds['e'] - bounds['w']) / bounds['cols']
+    return dict(n=bounds['n'] + halo * nsres, s=bounds['s'] - halo * nsres,
+                w=bounds['w'] - halo * ewres, e=bounds['e'] + halo * ewres,
+                rows=bounds['rows'] + 2 * halo, cols=bounds['cols'] + 2 * halo)
+
+
+def read_window(input, bounds, array):
+    """Read the part of the raster file input inside bounds into array
+
+    array covers bounds, in the resolution of the file. Returns the
+    slices of array read from the file, None if it does not overlap
+    bounds.
+    """
+    dataset, file_bounds = open_raster(input)
+    nsres = (bounds['n'] - bounds['s']) / bounds['rows']
+    ewres = (bounds['e'] - bounds['w']) / bounds['cols']
+    row_offset = int(round((bounds['n'] - file_bounds['n']) / nsres))
+    col_offset = int(round((file_bounds['w'] - bounds['w']) / ewres))
+    row_start = max(0, row_offset)
+    row_stop = min(bounds['rows'], row_offset + file_bounds['rows'])
+    col_start = max(0, col_offset)
+    col_stop = min(bounds['cols'], col_offset + file_bounds['cols'])
+    if row_start >= row_stop or col_start >= col_stop:
+        return None
+    array[row_start:row_stop, col_start:col_stop] = \
+        dataset.GetRasterBand(1).ReadAsArray(
+            col_start - col_offset, row_start - row_offset,
+            col_stop - col_start, row_stop - row_start)
+    dataset = None
+    return (slice(row_start, row_stop), slice(col_start, col_stop))
+
+
+def grid_origin(bounds):
+    """Return the (row, col) of the first cell of bounds in the global grid
+
+    The global grid starts at 90N 180W with the resolution of bounds.
+    """
+    nsres = (bounds['n'] - bounds['s']) / bounds['rows']
+    ewres = (bounds['e'] - bounds['w']) / bounds['cols']
+    return (int(round((90 - bounds['n']) / nsres)),
+            int(round((bounds['w'] + 180) / ewres)))
+
+
+def read_dsm(input, msk=None, value=-9999, halo=0, neighbours=()):
+    """Read an AW3D tile, and its MSK file if given, with GDAL
+
+    With halo, the tile is read with a border of halo cells from the
+    neighbours, a list of the DSM and MSK files of the neighbouring
+    tiles; cells of the border without a neighbour are outside: they
+    are neither voids nor support points.
+
+    Returns the DSM and the mask (None without msk) as arrays, the
+    outside cells, the bounds of the arrays as dict for g.region and the
+    slices of the tile in the arrays.
+    """
+    core = tile_bounds(input)
+    bounds = grow_bounds(core, halo)
+    window = (slice(halo, halo + core['rows']), slice(halo, halo + core['cols']))
+
+    dsm = np.full((bounds['rows'], bounds['cols']), value, dtype=np.int16)
+    outside = np.ones(dsm.shape, dtype=bool)
+    outside[read_window(input, bounds, dsm)] = False
+    if msk:
+        quality = np.zeros(dsm.shape, dtype=np.uint8)
+        mask_bounds = tile_bounds(msk)
+        if (mask_bounds['rows'], mask_bounds['cols']) != (core['rows'], core['cols']):
+            grass.fatal(_("Mask file <%s> does not match the size of <%s>") %
+                        (msk, input))
+        read_window(msk, bounds, quality)
+    else:
+        quality = None
+
+    for neighbour, neighbour_msk in neighbours:
+        read = read_window(neighbour, bounds, dsm)
+        if read:
+            outside[read] = False
+            if quality is not None and neighbour_msk:
+                read_window(neighbour_msk, bounds, quality)
+    return dsm, quality, outside, bounds, window
+
+
+class SrtmStore(object):
+    """Local directory of SRTM HGT tiles
+
+    Tiles are found by their name (e.g. N35E139.hgt, N35E139.hgt.zip or
+    N35E139.SRTMGL1.hgt.zip); the decoded tiles of the last size tiles
+    used are kept in memory (LRU), so that neighbouring AW3D tiles of a
+    batch run decode their SRTM tiles once per process.
+    """
+    def __init__(self, path, size=9):
+        self.path = path
+        self.size = size
+        self.tiles = OrderedDict()
+        self.files = {}
+        for name in sorted(os.listdir(path)):
+            if name.lower().endswith(('.hgt', '.hgt.zip')):
+                self.files.setdefault(name[:7].upper(), os.path.join(path, name))
+
+    @staticmethod
+    def tile_name(lat, lon):
+        """Return the name of the SRTM tile with lower left corner lat, lon"""
+        return '%s%02d%s%03d' % ('N' if lat >= 0 else 'S', abs(lat),
+                                 'E' if lon >= 0 else 'W', abs(lon))
+
+    def tile_names(self, bounds):
+        """Return the names of the tiles covering bounds"""
+        return [self.tile_name(lat, lon)
+                for lat in range(int(math.floor(bounds['s'] + 1e-9)),
+                                 int(math.ceil(bounds['n'] - 1e-9)))
+                for lon in range(int(math.floor(bounds['w'] + 1e-9)),
+                                 int(math.ceil(bounds['e'] - 1e-9)))]
+
+    def tile_side(self, name):
+        """Return the number of rows (and columns) of a tile file"""
+        path = self.files[name]
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                size = max(info.file_size for info in archive.infolist())
+        else:
+            size = os.path.getsize(path)
+        return int(round(math.sqrt(size // 2)))
+
+    def tile(self, name):
+        """Return the decoded tile as int16 array, None if it is missing"""
+        if name in self.tiles:
+            data = self.tiles.pop(name)
+            self.tiles[name] = data
+            return data
+        if name not in self.files:
+            return None
+        path = self.files[name]
+        if zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                member = [info for info in archive.infolist()
+                          if info.filename.lower().endswith('.hgt')][0]
+                raw = archive.read(member)
+        else:
+            with open(path, 'rb') as fd:
+                raw = fd.read()
+        side = int(round(math.sqrt(len(raw) // 2)))
+        data = np.frombuffer(raw, dtype='>i2').reshape(side, side).astype(np.int16)
+        self.tiles[name] = data
+        while len(self.tiles) > self.size:
+            self.tiles.popitem(last=False)
+        return data
+
+    def window(self, bounds):
+        """Return the SRTM heights of the cells of bounds as float array
+
+        Nearest neighbour of the cell centres; cells without a tile and
+        voids of SRTM are NaN.
+        """
+        rows, cols = bounds['rows'], bounds['cols']
+        lats = bounds['n'] - (np.arange(rows) + 0.5) * (bounds['n'] - bounds['s']) / rows
+        lons = bounds['w'] + (np.arange(cols) + 0.5) * (bounds['e'] - bounds['w']) / cols
+        result = np.full((rows, cols), np.nan, dtype=np.float32)
+        for lat in np.unique(np.floor(lats)).astype(int):
+            row_index = np.nonzero(np.floor(lats) == lat)[0]
+            for lon in np.unique(np.floor(lons)).astype(int):
+                data = self.tile(self.tile_name(lat, lon))
+                if data is None:
+                    grass.warning(_("SRTM tile <%s> not found in <%s>") %
+                                  (self.tile_name(lat, lon), self.path))
+                    continue
+                col_index = np.nonzero(np.floor(lons) == lon)[0]
+                step = data.shape[0] - 1
+                trows = np.rint((lat + 1 - lats[row_index]) * step).astype(int)
+                tcols = np.rint((lons[col_index] - lon) * step).astype(int)
+                result[np.ix_(row_index, col_index)] = data[np.ix_(trows, tcols)]
+        result[result == -32768] = np.nan
+        return result
+
+
+# SRTM stores of this process by directory, kept over the tiles of a batch
+srtm_stores = {}
+
+
+def srtm_store(path, size):
+    """Return the SRTM store of the directory path of this process"""
+    if path not in srtm_stores:
+        srtm_stores[path] = SrtmStore(path, size)
+    return srtm_stores[path]
+
+
+def import_srtm(srtm_dir, maps, run):
+    """Import the local SRTM tiles covering the current region as srtm_patch"""
+    store = SrtmStore(srtm_dir)
+    region = grass.region()
+    names = []
+    for name in store.tile_names(region):
+        if name not in store.files:
+            grass.warning(_("SRTM tile <%s> not found in <%s>") % (name, srtm_dir))
+            continue
+        tilemap = '%s_srtm_%s' % (run, name)
+        if store.tile_side(name) == 3601:
+            one = '1'
+        else:
+            one = ''
+        grass.run_command("r.in.srtm",
+                          input = store.files[name],
+                          output = tilemap,
+                          flags = one,
+                          quiet = True,
+                          overwrite = True)
+        names.append(tilemap)
+    if not names:
+        grass.fatal(_("No SRTM tiles found in <%s>") % srtm_dir)
+    try:
+        grass.run_command("r.patch",
+                          input = ','.join(names),
+                          output = maps['srtm_patch'],
+                          overwrite = True)
+    finally:
+        remove_maps(names)
+
+
+def find_voids(dsm, quality, value, msk_values):
+    """Return the void cells: the hole value, and msk_values of quality"""
+    void = dsm == int(value)
+    if quality is not None:
+        void |= np.isin(quality, [int(v) for v in msk_values])
+    return void
+
+
+def dilate(mask, distance):
+    """Return mask grown by distance cells (circular, like r.buffer)"""
+    rows, cols = mask.shape
+    grown = mask.copy()
+    for dy in range(-distance, distance + 1):
+        for dx in range(-distance, distance + 1):
+            if (dy, dx) == (0, 0) or dy * dy + dx * dx > distance * distance:
+                continue
+            grown[max(0, dy):rows + min(0, dy), max(0, dx):cols + min(0, dx)] |= \
+                mask[max(0, -dy):rows + min(0, -dy), max(0, -dx):cols + min(0, -dx)]
+    return grown
+
+
+def interpolate(rows, cols, values, qrows, qcols):
+    """Interpolate values at cells (rows, cols) to cells (qrows, qcols)
+
+    Linear interpolation on the triangulation of the points if SciPy is
+    available; cells outside of their convex hull, and all cells without
+    SciPy, get inverse distance weighted values.
+    """
+    result = np.full(len(qrows), np.nan, dtype=np.float64)
+    if len(values) == 0:
+        return result
+    points = np.column_stack((rows, cols)).astype(np.float64)
+    query = np.column_stack((qrows, qcols)).astype(np.float64)
+
+    if SCIPY and len(values) >= 3:
+        try:
+            result = sinterpolate.griddata(points, values, query, method='linear')
+        except Exception:
+            # degenerated triangulation, e.g. all points on one line
+            pass
+
+    outside = np.nonzero(np.isnan(result))[0]
+    chunk = max(1, 4000000 // len(values))
+    for start in range(0, len(outside), chunk):
+        index = outside[start:start + chunk]
+        dist = ((query[index, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+        weights = 1.0 / np.maximum(dist, 1e-12)
+        result[index] = (weights * values).sum(axis=1) / weights.sum(axis=1)
+    return result
+
+
+def sample_cells(mask, random, rng, sampling='random', max_points=0):
+    """Draw random percent of the cells of mask, at most max_points
+
+    sampling 'random' draws uniformly (like r.random), 'stratified' one
+    cell at a random position in each square stratum of a grid sized for
+    the number of points, which spreads the points evenly over the mask.
+    Returns the rows and columns of the cells.
+    """
+    rows, cols = np.nonzero(mask)
+    npoints = int(round(len(rows) * float(random) / 100))
+    if max_points:
+        npoints = min(npoints, max_points)
+    if npoints == 0:
+        return rows[:0], cols[:0]
+
+    if sampling == 'stratified':
+        stride = max(1, int(np.sqrt(len(rows) / float(npoints))))
+        strata = (rows // stride) * (mask.shape[1] // stride + 1) + cols // stride
+        order = np.lexsort((rng.random_sample(len(rows)), strata))
+        pick = order[np.unique(strata[order], return_index=True)[1]]
+        if len(pick) > npoints:
+            pick = np.sort(pick[rng.permutation(len(pick))[:npoints]])
+    else:
+        pick = rng.permutation(len(rows))[:npoints]
+    return rows[pick], cols[pick]
+
+
+def fill_voids(dsm, srtm, void, random, rng, invalid=None, distance=2,
+               sampling='random', ring=0, max_points=0, method='points'):
+    """Fill the void cells of dsm in memory, return the filled float DSM
+
+    Follows grass_commands(): the support points are the DSM cells in a
+    buffer of distance cells around the voids (r.grow) and random
+    percent of the SRTM cells inside the voids (r.random); the voids are
+    interpolated from them (r.resamp.bspline) and patched into the DSM. Cells
+    of invalid (default: void) are no support points. SRTM cells are
+    also drawn from a ring of ring cells around the voids outside of the
+    buffer; see sample_cells() for sampling. max_points limits the SRTM
+    points of each void (with its ring).
+
+    method 'delta' fills the voids with the SRTM values plus the
+    AW3D-SRTM offset interpolated from the buffer cells, without random
+    points; voids of the SRTM stay null.
+    """
+    if invalid is None:
+        invalid = void
+    filled = dsm.astype(np.float32)
+    filled[invalid] = np.nan
+    if not void.any():
+        return filled
+
+    buffer = dilate(void, distance) & ~invalid
+    vrows, vcols = np.nonzero(void)
+
+    if method == 'delta':
+        edge = buffer & ~np.isnan(srtm)
+        erows, ecols = np.nonzero(edge)
+        offset = interpolate(erows, ecols,
+                             dsm[edge].astype(np.float64) - srtm[edge],
+                             vrows, vcols)
+        # no edge cells, e.g. the void covers the whole tile
+        offset[np.isnan(offset)] = 0
+        filled[void] = srtm[void] + offset
+        return filled
+
+    brows, bcols = np.nonzero(buffer)
+    bvalues = dsm[buffer].astype(np.float64)
+
+    candidates = void
+    if ring:
+        candidates = void | (dilate(void, ring) & ~invalid & ~buffer)
+    if max_points:
+        # the limit is per void: sample each void with its ring separately
+        labels, boxes = void_clusters(candidates)
+        srows, scols = [], []
+        for label, row_start, row_stop, col_start, col_stop in boxes:
+            rows, cols = sample_cells(
+                labels[row_start:row_stop, col_start:col_stop] == label,
+                random, rng, sampling, max_points)
+            srows.append(rows + row_start)
+            scols.append(cols + col_start)
+        srows = np.concatenate(srows)
+        scols = np.concatenate(scols)
+    else:
+        srows, scols = sample_cells(candidates, random, rng, sampling)
+    svalues = srtm[srows, scols].astype(np.float64)
+    valid = ~np.isnan(svalues)
+
+    filled[void] = interpolate(np.concatenate((brows, srows[valid])),
+                               np.concatenate((bcols, scols[valid])),
+                               np.concatenate((bvalues, svalues[valid])),
+                               vrows, vcols)
+    return filled
+
+
+def void_clusters(void):
+    """Label the connected void cells (8-neighbourhood)
+
+    Returns the labels and a list of (label, row_start, row_stop,
+    col_start, col_stop) bounding boxes, ordered by label.
+    """
+    if SCIPY:
+        labels, count = ndimage.label(void, structure=np.ones((3, 3)))
+    else:
+        # propagate the largest cell number through each cluster
+        rows, cols = void.shape
+        labels = np.where(void, np.arange(1, void.size + 1).reshape(void.shape), 0)
+        changed = True
+        while changed:
+            grown = labels.copy()
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    dst = grown[max(0, dy):rows + min(0, dy), max(0, dx):cols + min(0, dx)]
+                    src = labels[max(0, -dy):rows + min(0, -dy), max(0, -dx):cols + min(0, -dx)]
+                    np.maximum(dst, src, out=dst)
+            grown[~void] = 0
+            changed = (grown != labels).any()
+            labels = grown
+        values, labels = np.unique(labels, return_inverse=True)
+        labels = labels.reshape(void.shape)
+        count = len(values) - 1
+
+    vrows, vcols = np.nonzero(labels)
+    index = labels[vrows, vcols]
+    row_start = np.full(count + 1, void.shape[0])
+    row_stop = np.zeros(count + 1, dtype=int)
+    col_start = np.full(count + 1, void.shape[1])
+    col_stop = np.zeros(count + 1, dtype=int)
+    np.minimum.at(row_start, index, vrows)
+    np.maximum.at(row_stop, index, vrows + 1)
+    np.minimum.at(col_start, index, vcols)
+    np.maximum.at(col_stop, index, vcols + 1)
+    boxes = [(label, int(row_start[label]), int(row_stop[label]),
+              int(col_start[label]), int(col_stop[label]))
+             for label in range(1, count + 1)]
+    return labels, boxes
+
+
+def fill_cluster_worker(args):
+    """Fill one void cluster, return its label and filled values
+
+    args are the label and seed of the cluster, its DSM, SRTM, cluster
+    and invalid windows and the keyword arguments of fill_voids().
+    """
+    label, seed, dsm, srtm, cluster, invalid, params = args
+    part = fill_voids(dsm, srtm, cluster, rng=np.random.RandomState(seed),
+                      invalid=invalid, **params)
+    return label, part[cluster]
+
+
+def fill_clusters(dsm, srtm, void, rng, nprocs=1, invalid=None, origin=(0, 0),
+                  **params):
+    """Fill each void cluster separately within its bounding box
+
+    The window of a cluster is its bounding box plus the buffer distance
+    (or the SRTM sampling ring), so the interpolation cost follows the
+    void area instead of the tile area. The clusters are filled by nprocs
+    processes. Cells of invalid (default: void) are no support points.
+    params are passed to fill_voids().
+
+    The seed of a cluster is made of one draw from rng and the position
+    of its bounding box in the grid, origin being the (row, col) of the
+    first cell of dsm. So the result depends neither on the number of
+    processes nor on the tile: a void read by two tiles with a halo gets
+    the same window, support points and seed in both.
+    """
+    if invalid is None:
+        invalid = void
+    filled = dsm.astype(np.float32)
+    filled[invalid] = np.nan
+    labels, boxes = void_clusters(void)
+    base = rng.randint(0, 2 ** 31 - 1)
+    pad = max(params.get('distance', 2), params.get('ring', 0))
+
+    windows = {}
+    tasks = []
+    for label, row_start, row_stop, col_start, col_stop in boxes:
+        seed = (base, origin[0] + row_start, origin[1] + col_start)
+        window = (slice(max(0, row_start - pad), row_stop + pad),
+                  slice(max(0, col_start - pad), col_stop + pad))
+        cluster = labels[window] == label
+        windows[label] = (window, cluster)
+        tasks.append((label, seed, dsm[window], srtm[window], cluster,
+                      invalid[window], params))
+
+    if nprocs > 1 and len(tasks) > 1:
+        grass.message(_("Filling %d void clusters with %d processes...") %
+                      (len(tasks), nprocs))
+        pool = multiprocessing.Pool(min(nprocs, len(tasks)))
+        try:
+            results = pool.map(fill_cluster_worker, tasks,
+                               chunksize=max(1, len(tasks) // (nprocs * 4)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [fill_cluster_worker(task) for task in tasks]
+
+    # merge in order of the labels
+    for label, values in results:
+        window, cluster = windows[label]
+        filled[window][cluster] = values
+    return filled
+
+
+# largest void (cells) filled with method delta by method auto
+PLAN_DELTA_CELLS = 10000
+# number of random points of a tile planned by method auto
+PLAN_POINTS = 50000
+
+
+def plan_tile(input, msk=None, msk_values=None, value=-9999, random=30,
+              memory=300):
+    """Read a tile once and plan its filling from the statistics of its voids
+
+    Returns a dict with the input and the plan of plan_voids().
+    """
+    dsm, quality, outside, bounds, window = read_dsm(input, msk, int(value))
+    void = find_voids(dsm, quality, value, msk_values)
+    dsm = quality = None
+    plan = plan_voids(void, random, memory)
+    plan['input'] = input
+    return plan
+
+
+def plan_voids(void, random=30, memory=300):
+    """Plan the filling of a tile from the statistics of its voids
+
+    Returns a dict with the statistics of the voids: fraction, number,
+    size distribution of the clusters (number of clusters by power of
+    ten of their cells) and whether they touch the edge of the tile; and
+    the settings: the method (delta for small voids, random points for
+    large ones), random (at most the given percent, reduced for large
+    voids to about PLAN_POINTS points) and memory (for the bounding box of
+    the voids, at most the given MB).
+    """
+    labels, boxes = void_clusters(void)
+    sizes = np.bincount(labels.ravel())[1:]
+    void_cells = int(void.sum())
+    edge = bool(void[0].any() or void[-1].any() or void[:, 0].any() or
+                void[:, -1].any())
+    distribution = {}
+    for size in sizes:
+        decade = str(10 ** int(math.log10(size)))
+        distribution[decade] = distribution.get(decade, 0) + 1
+    statistics = dict(cells=int(void.size), void_cells=void_cells,
+                      void_fraction=round(float(void_cells) / void.size, 6),
+                      clusters=len(boxes),
+                      largest_cluster=int(sizes.max()) if len(sizes) else 0,
+                      median_cluster=int(np.median(sizes)) if len(sizes) else 0,
+                      cluster_sizes=distribution, touches_edge=edge)
+
+    if statistics['largest_cluster'] <= PLAN_DELTA_CELLS:
+        method = 'delta'
+    else:
+        method = 'points'
+    tile_random = int(random)
+    if void_cells:
+        tile_random = max(1, min(tile_random, 100 * PLAN_POINTS // void_cells))
+    if boxes:
+        rows = max(box[2] for box in boxes) - min(box[1] for box in boxes)
+        cols = max(box[4] for box in boxes) - min(box[3] for box in boxes)
+        # r.resamp.bspline keeps a few double maps of the region of the voids
+        tile_memory = int(math.ceil(rows * cols * 32 / 2.0 ** 20))
+    else:
+        tile_memory = 0
+    tile_memory = max(10, min(int(memory), tile_memory))
+    settings = dict(method=method, random=tile_random, memory=tile_memory)
+    return dict(statistics=statistics, settings=settings)
+
+
+def numpy_commands(input, username_srtm, password_srtm, value, output,
+                   clusters=False, nprocs=1, seed=None, msk=None,
+                   msk_values=None, run='tmp_aw3d', srtm_dir=None,
+                   srtm_cache=9, halo=0, neighbours=(), manifest=None,
+                   **params):
+    """Fill the dataholes of an AW3D tile in memory
+
+    The tile is read with GDAL, the SRTM patch of its extent is imported
+    and read once, or read from the SRTM tiles in srtm_dir, keeping the
+    last srtm_cache tiles decoded; only the filled output map is written.
+    The voids are the cells with the hole value and the cells of the MSK
+    file msk with one of msk_values. params are passed to fill_voids().
+
+    With halo, the tile is filled with a border of halo cells read from
+    the neighbours (see read_dsm()), so voids crossing the border of the
+    tile are filled from both sides; only the tile itself is written.
+    The voids are then filled by cluster (see fill_clusters()), so a void
+    within halo minus the buffer distance (or ring) of the border is
+    filled alike by both tiles, with either method.
+
+    With method 'auto', the method and random are planned from the voids
+    of the tile read here (see plan_voids()).
+    """
+    dsm, quality, outside, bounds, window = read_dsm(input, msk, int(value),
+                                                     halo, neighbours)
+    srtm_patch = temp_maps(run)['srtm_patch']
+
+    void = find_voids(dsm, quality, value, msk_values) & ~outside
+    invalid = void | outside
+    quality = None
+    if params.get('method') == 'auto':
+        settings = plan_voids(void[window], params.get('random', 30))['settings']
+        grass.verbose(_("Tile <%s>: method=%s random=%s") %
+                      (input, settings['method'], settings['random']))
+        params['method'] = settings['method']
+        params['random'] = str(settings['random'])
+
+    grass.use_temp_region()
+    try:
+        grass.run_command("g.region", **bounds)
+        if srtm_dir:
+            srtm = srtm_store(srtm_dir, srtm_cache).window(bounds)
+        else:
+            try:
+                grass.run_command("r.in.srtm.region",
+                                  user = username_srtm,
+                                  password = password_srtm,
+                                  flags = 1,
+                                  output = srtm_patch)
+                srtm = garray.array(srtm_patch, null=-32768, dtype=np.float32)
+            finally:
+                remove_temp_maps(run)
+            srtm[srtm == -32768] = np.nan
+
+        grass.message(("filling null values of %s") % output)
+        rng = np.random.RandomState(seed)
+        if clusters or nprocs > 1 or halo:
+            filled = fill_clusters(dsm, srtm, void, rng, nprocs,
+                                   invalid=invalid, origin=grid_origin(bounds),
+                                   **params)
+        else:
+            filled = fill_voids(dsm, srtm, void, rng=rng, invalid=invalid,
+                                **params)
+
+        if halo:
+            grass.run_command("g.region", **tile_bounds(input))
+        result = garray.array(dtype=np.float32)
+        result[...] = filled[window]
+        if manifest is None:
+            overwrite = grass.overwrite()
+        else:
+            overwrite = manifest.overwrite()
+        result.write(output, overwrite=overwrite)
+    finally:
+        grass.del_temp_region()
+    if manifest is not None:
+        manifest.finish()
+
+
+def fill_tile_worker(args):
+    """Fill one tile, returning an error message instead of exiting
+
+    args are the engine and the keyword arguments of grass_commands() or
+    numpy_commands(). A tile that cannot be filled is returned with
+    its error for the summary of main(), whichever process fills it.
+
+    With method 'auto', the GRASS chain is planned here from a read of
+    the tile; numpy_commands() plans from its own read.
+    """
+    engine, kwargs = args
+    raise_on_error = grass.get_raise_on_error()
+    grass.set_raise_on_error(True)
+    try:
+        if engine == 'numpy':
+            numpy_commands(**kwargs)
+        else:
+            if kwargs['method'] == 'auto':
+                settings = plan_tile(kwargs['input'], kwargs['msk'],
+                                     kwargs['msk_values'], kwargs['value'],
+                                     kwargs['random'], kwargs['memory'])['settings']
+                grass.verbose(_("Tile <%s>: method=%s random=%s memory=%s") %
+                              (kwargs['input'], settings['method'],
+                               settings['random'], settings['memory']))
+                kwargs = dict(kwargs, method=settings['method'],
+                              random=str(settings['random']),
+                              memory=str(settings['memory']))
+            grass_commands(**kwargs)
+    except (ScriptError, CalledModuleError, IOError, OSError, ValueError,
+            AttributeError, RuntimeError) as e:
+        # NumPy and GDAL on a broken tile
+        return (kwargs['input'], kwargs['output'], str(e))
+    finally:
+        grass.set_raise_on_error(raise_on_error)
+    return (kwargs['input'], kwargs['output'], None)
 
-# patch and finish
-    grass.run_command("r.patch",
-                      input = "jaxa_patch,fill_data",
-                      output = output)
 
-    grass.run_command("g.remove", flags = "f", type = "raster", name = "jaxa_patch,srtm_patch,mask,buffer_mask,buffer_fill,random_points,patch_random_buffer,fill_data")
-      
 def main():
-    input = options['input']
+    # paths before changing to the temporary directory
+    inputs = [os.path.abspath(name) for name in options['input'].split(',')]
     output = options['output']
     username_jaxa = options['username_jaxa']
     password_jaxa = options['password_jaxa']
@@ -251,6 +1240,24 @@ def main():
     memory = options['memory']
     random = options['random']
     value = options['value']
+    if options['msk']:
+        msks = [os.path.abspath(name) for name in options['msk'].split(',')]
+        if len(msks) != len(inputs):
+            grass.fatal(_("Number of mask files and input files differ"))
+    else:
+        msks = [None] * len(inputs)
+    msk_values = options['msk_values'].split(',')
+    if options['srtm_dir']:
+        srtm_dir = os.path.abspath(options['srtm_dir'])
+    else:
+        srtm_dir = None
+    if options['checkpoint']:
+        checkpoint = os.path.abspath(options['checkpoint'])
+        if not os.path.isdir(checkpoint):
+            os.makedirs(checkpoint)
+    else:
+        checkpoint = None
+    nprocs = int(options['nprocs'])
     
     overwrite = grass.overwrite()
     
@@ -282,7 +1289,7 @@ def main():
     s = grass.read_command("g.proj", flags='j')
     kv = grass.parse_key_val(s)
     if kv['+proj'] != 'longlat':
-	grass.fatal(_("This module only operates in LatLong locations"))
+        grass.fatal(_("This module only operates in LatLong locations"))
 
  ###########################################
 
@@ -332,11 +1339,119 @@ def main():
 #                fold = path
 #################################################
 
-    grass_commands(input, username_srtm, password_srtm, random, value, output, memory)
+    engine = options['engine']
+    if engine == 'numpy':
+        if not (NUMPY and GDAL):
+            grass.fatal(_("engine=numpy requires NumPy and the Python GDAL library"))
+        seed = int(options['seed'])
+        sampling = options['sampling']
+
+    # planning pass, method=auto plans each tile in its worker
+    method = options['method']
+    if flags['p']:
+        if not (NUMPY and GDAL):
+            grass.fatal(_("Planning requires NumPy and the Python GDAL library"))
+        plans = [plan_tile(input, msk, msk_values, value, random, memory)
+                 for input, msk in zip(inputs, msks)]
+        sys.stdout.write(json.dumps(plans, indent=2, sort_keys=True) + '\n')
+        return 0
+    if method == 'auto' and not (NUMPY and GDAL):
+        grass.warning(_("method=auto requires NumPy and the Python GDAL library, using method=points"))
+        method = 'points'
+
+    halo = int(options['halo'])
+    if halo:
+        if engine != 'numpy':
+            grass.fatal(_("halo requires engine=numpy"))
+        bounds = [tile_bounds(input) for input in inputs]
+
+    # with several tiles the processes fill the tiles, not the clusters
+    if len(inputs) > 1:
+        tile_nprocs = 1
+    else:
+        tile_nprocs = nprocs
+
+    jobs = []
+    for index, (input, msk) in enumerate(zip(inputs, msks)):
+        if len(inputs) == 1:
+            tileout = output
+        else:
+            tileout = output + '_' + os.path.splitext(os.path.basename(input))[0]
+        # a resumed run may have written its output already
+        if not overwrite and not flags['r'] and \
+                grass.find_file(tileout, element='cell', mapset='.')['file']:
+            grass.fatal(_("Raster map <%s> already exists") % tileout)
+        run = '%s_%d' % (run_prefix, index)
+        neighbours = []
+        if halo:
+            grown = grow_bounds(bounds[index], halo)
+            for other, (neighbour, neighbour_msk) in enumerate(zip(inputs, msks)):
+                if other != index and \
+                        bounds[other]['s'] < grown['n'] and bounds[other]['n'] > grown['s'] and \
+                        bounds[other]['w'] < grown['e'] and bounds[other]['e'] > grown['w']:
+                    neighbours.append((neighbour, neighbour_msk))
+        if engine == 'numpy':
+            kwargs = dict(input=input, username_srtm=username_srtm,
+                          password_srtm=password_srtm, value=value,
+                          output=tileout,
+                          clusters=flags['c'] or sampling == 'stratified',
+                          nprocs=tile_nprocs, seed=seed, msk=msk,
+                          msk_values=msk_values, run=run,
+                          random=random,
+                          sampling=sampling, ring=int(options['ring']),
+                          max_points=int(options['max_points']),
+                          method=method, srtm_dir=srtm_dir,
+                          srtm_cache=int(options['srtm_cache']),
+                          halo=halo, neighbours=neighbours)
+        else:
+            kwargs = dict(input=input, username_srtm=username_srtm,
+                          password_srtm=password_srtm,
+                          random=random, value=value,
+                          output=tileout, memory=memory,
+                          method=method, msk=msk,
+                          msk_values=msk_values, run=run, srtm_dir=srtm_dir)
+        if checkpoint:
+            # the maps of a run with manifest must keep their names
+            kwargs['run'] = resumable_run(tileout)
+            params = dict((key, item) for key, item in kwargs.items()
+                          if key not in ('username_srtm', 'password_srtm',
+                                         'nprocs', 'neighbours', 'run'))
+            params['engine'] = engine
+            manifest = Manifest(os.path.join(checkpoint, tileout + '.json'),
+                                params, flags['r'])
+            if manifest.finished() and grass.find_file(tileout, element='cell')['file']:
+                grass.message(_("Tile <%s> already filled, skipping") % input)
+                continue
+            kwargs['manifest'] = manifest
+        else:
+            temp_runs.append(run)
+        jobs.append((engine, kwargs))
+
+    if nprocs > 1 and len(jobs) > 1:
+        grass.message(_("Filling %d tiles with %d processes...") %
+                      (len(jobs), nprocs))
+        pool = multiprocessing.Pool(min(nprocs, len(jobs)))
+        try:
+            results = pool.map(fill_tile_worker, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [fill_tile_worker(job) for job in jobs]
 
+    failed = [(input, error) for input, tileout, error in results if error]
+    for input, error in failed:
+        grass.warning(_("Tile <%s> not filled: %s") % (input, error))
+    if len(jobs) > 1:
+        grass.message(_("Filled %d of %d tiles") %
+                      (len(jobs) - len(failed), len(jobs)))
+    if failed:
+        grass.fatal(_("%d of %d tiles could not be filled") %
+                    (len(failed), len(jobs)))
 
     return 0
 
 if __name__ == "__main__":
     options, flags = grass.parser()
+    atexit.register(cleanup)
     sys.exit(main())
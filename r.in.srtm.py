@@ -64,13 +64,97 @@
 #% keyword: import
 #%End
 #%option G_OPT_F_INPUT
-#% description: Name of SRTM HGT / SRTM RAW input tile
+#% description: Name of SRTM HGT / SRTM RAW input tile(s), glob pattern(s) or directory(ies)
+#% multiple: yes
+#% required: no
 #%end
 #%option G_OPT_R_OUTPUT
-#% description: Name for output raster map (default: input tile)
+#% description: Name for output raster map (default: input tile); prefix if several tiles are imported
 #% required : no
 #%end
 #%flag
+#% key: z
+#% description: Read zip archives in-process and link unzipped tiles (no unzip program, no temporary copies)
+#%end
+#%flag
+#% key: g
+#% description: Import with r.in.gdal/r.in.bin instead of the native NumPy reader
+#%end
+#%flag
+#% key: r
+#% description: Import only the part of the tile(s) overlapping the current region
+#%end
+#%option G_OPT_F_INPUT
+#% key: catalog
+#% description: Tile catalog (SQLite) to update with input and to import the tiles overlapping the current region from
+#% required: no
+#%end
+#%flag
+#% key: c
+#% description: Only update the tile catalog with input, do not import
+#%end
+#%flag
+#% key: m
+#% description: Mosaic all tiles into one output raster map in a single pass
+#%end
+#%option G_OPT_M_DIR
+#% key: cache
+#% description: Directory of the cache of imported tiles (not used with -m)
+#% required: no
+#%end
+#%option
+#% key: cache_size
+#% type: integer
+#% required: no
+#% multiple: no
+#% description: Maximum size of the cache in MB
+#% answer: 4096
+#%end
+#%flag
+#% key: l
+#% description: List the contents of the cache and exit
+#%end
+#%flag
+#% key: p
+#% description: Remove all tiles from the cache and exit
+#%end
+#%option G_OPT_F_INPUT
+#% key: swbd
+#% description: SRTM SWBD RAW tile(s), glob pattern(s) or directory(ies) matching the HGT input tiles
+#% multiple: yes
+#% required: no
+#% guisection: Water
+#%end
+#%option
+#% key: swbd_method
+#% type: string
+#% required: no
+#% multiple: no
+#% options: flatten,null
+#% descriptions: flatten;Set water bodies to their lowest elevation;null;Set water to null
+#% description: Treatment of water cells given by swbd
+#% answer: flatten
+#% guisection: Water
+#%end
+#%flag
+#% key: s
+#% description: Also write the SWBD water mask as raster map <output>_water
+#% guisection: Water
+#%end
+#%option G_OPT_M_DIR
+#% key: cog
+#% description: Directory to also write the output as Cloud-Optimized GeoTIFF <output>.tif to
+#% required: no
+#%end
+#%option
+#% key: nprocs
+#% type: integer
+#% required: no
+#% multiple: no
+#% description: Number of processes for importing several tiles in parallel
+#% answer: 1
+#%end
+#%flag
 #% key: 1
 #% description: Input is a 1-arcsec tile (default: 3-arcsec)
 #%end
@@ -78,6 +162,17 @@
 #% key: w
 #% description: Import SRTM SWBD (SRTM Water Body Data)
 #%end
+#%rules
+#% required: input,catalog,-l,-p
+#% requires: -c,catalog
+#% requires: -l,cache
+#% requires: -p,cache
+#% requires: -m,output
+#% excludes: -m,-g
+#% excludes: swbd,-w,-m,-g
+#% requires: -s,swbd
+#% excludes: cog,-g
+#%end
 
 tmpl1sec = """BYTEORDER M
 LAYOUT BIL
@@ -122,195 +217,1342 @@ proj = ''.join([
     ']'])
 
 import os
+import re
+import sys
+import glob
+import math
+import time
+import hashlib
+import sqlite3
+import zlib
 import shutil
+import zipfile
 import atexit
+import multiprocessing
 import grass.script as grass
-from grass.exceptions import CalledModuleError
+from grass.exceptions import CalledModuleError, ScriptError
+
+global NATIVE
+
+try:
+    import numpy as np
+    from grass.pygrass.gis.region import Region
+    from grass.pygrass.raster import RasterRow
+    from grass.pygrass.raster.buffer import Buffer
+    NATIVE = True
+except ImportError:
+    NATIVE = False
+
+global GDAL
+
+try:
+    from osgeo import gdal
+    GDAL = True
+except ImportError:
+    GDAL = False
+
+global SCIPY
+
+try:
+    from scipy import ndimage
+    SCIPY = True
+except ImportError:
+    SCIPY = False
+
+# (product, arcsec) of tiles by number of bytes of the HGT/RAW grid
+TILE_BYTES = {
+    3601 * 3601 * 2: ('HGT', 1),
+    1201 * 1201 * 2: ('HGT', 3),
+    3601 * 3601: ('SWBD', 1),
+}
+
+# null value of HGT tiles and of GRASS CELL maps
+HGT_NODATA = -32768
+CELL_NULL = -2147483648
+
+# largest GeoTIFF written from memory (cells of a 1-arcsec tile)
+MEM_CELLS = 3601 * 3601
+
+# temporary directories of tiles being imported by this process
+tmpdirs = []
 
 
 def cleanup():
-    if not in_temp:
+    for tmpdir in tmpdirs[:]:
+        cleanup_tile(tmpdir)
+
+
+def cleanup_tile(tmpdir):
+    if not os.path.isdir(tmpdir):
         return
-    for ext in ['.bil', '.hdr', '.prj', '.hgt.zip', '.raw', '.raw.zip']:
-        grass.try_remove(tile + ext)
-    os.chdir('..')
+    for name in os.listdir(tmpdir):
+        grass.try_remove(os.path.join(tmpdir, name))
     grass.try_rmdir(tmpdir)
+    if tmpdir in tmpdirs:
+        tmpdirs.remove(tmpdir)
 
 
-def main():
-    global tile, tmpdir, in_temp
+def strip_extension(infile):
+    while infile[-4:].lower() in ['.hgt', '.zip', '.raw']:
+        infile = infile[:-4]
+    return infile
 
-    in_temp = False
 
-    input = options['input']
-    output = options['output']
-    one = flags['1']
-    water = flags['w']
+# name of an SRTM tile file, e.g. N51E010.hgt.zip or S01W078.SRTMGL1.hgt.zip
+TILE_NAME = re.compile(r'^[NS]\d{2}[EW]\d{3}', re.IGNORECASE)
 
-    # are we in LatLong location?
-    s = grass.read_command("g.proj", flags='j')
-    kv = grass.parse_key_val(s)
-    if kv['+proj'] != 'longlat':
-        grass.fatal(_("This module only operates in LatLong locations"))
 
-    # use these from now on:
-    infile = input
-    while infile[-4:].lower() in ['.hgt', '.zip', '.raw']:
-        infile = infile[:-4]
-    (fdir, tile) = os.path.split(infile)
+def expand_input(input, water):
+    """Expand comma separated tiles, glob patterns and directories
 
-    if not output:
-        tileout = tile
-        grass.debug("No output set... using name: " + tileout)
+    Returns the tile names without extension in input order, each tile
+    only once. Files of directories and glob patterns that are not named
+    like SRTM tiles are skipped.
+    """
+    if water:
+        exts = ('.raw', '.raw.zip')
     else:
-        tileout = output
+        exts = ('.hgt', '.hgt.zip')
+
+    infiles = []
+    for item in input.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if os.path.isdir(item):
+            names = [os.path.join(item, name) for name in sorted(os.listdir(item))]
+        elif any(c in item for c in '*?['):
+            names = sorted(glob.glob(item))
+        else:
+            infiles.append(item)
+            continue
+        for name in names:
+            if not name.lower().endswith(exts):
+                continue
+            if TILE_NAME.match(os.path.basename(name)):
+                infiles.append(name)
+            else:
+                grass.warning(_("<%s> is not named like an SRTM tile, skipped") % name)
+
+    tiles = []
+    for infile in infiles:
+        infile = strip_extension(infile)
+        if infile not in tiles:
+            tiles.append(infile)
+    return tiles
+
+
+def find_member(archive, name):
+    """Return the archive member holding the tile data
+
+    Falls back to the first member with the same extension if the member
+    is not named like the tile (e.g. N51E010.SRTMGL1.hgt.zip).
+    """
+    names = archive.namelist()
+    if name in names:
+        return name
+    ext = os.path.splitext(name)[1].lower()
+    for member in names:
+        if member.lower().endswith(ext):
+            return member
+    grass.fatal(_("No '%s' file found in '%s'") % (ext, archive.filename))
+
+
+def extract_member(zippath, name, target):
+    """Decompress the tile data of a zip archive into target
+
+    The archive is read once; the CRC of the member is verified while it
+    is streamed to target.
+    """
+    try:
+        archive = zipfile.ZipFile(zippath)
+        try:
+            src = archive.open(find_member(archive, name))
+            dst = open(target, 'wb')
+            try:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            finally:
+                dst.close()
+                src.close()
+        finally:
+            archive.close()
+    except (zipfile.BadZipfile, zlib.error) as e:
+        grass.fatal(_("'%s' does not appear to be a valid zip file: %s") % (zippath, e))
+
+
+def link_or_copy(src, dst):
+    if hasattr(os, 'symlink'):
+        os.symlink(os.path.abspath(src), dst)
+    else:
+        shutil.copyfile(src, dst)
+
+
+def tile_origin(tile):
+    """Return latitude and longitude of the lower left cell center of a tile"""
+    north = tile[0]
+    ll_latitude = int(tile[1:3])
+    east = tile[3]
+    ll_longitude = int(tile[4:7])
+
+    # are we on the southern hemisphere? If yes, make LATITUDE negative.
+    if north == "S":
+        ll_latitude *= -1
+
+    # are we west of Greenwich? If yes, make LONGITUDE negative.
+    if east == "W":
+        ll_longitude *= -1
+
+    return ll_latitude, ll_longitude
+
+
+def tile_size(one, water):
+    """Return the number of rows (and columns) of a tile"""
+    if one or water:
+        return 3601
+    return 1201
+
+
+def locate_tile(infile, water, inproc):
+    """Find the zip archive or the unzipped data file of a tile
+
+    Returns the tile name, the path of the data file or zip archive and
+    whether it is a zip archive.
+    """
+    infile = strip_extension(infile)
+    (fdir, tile) = os.path.split(infile)
 
     if not water:
-        zipfile = infile + ".hgt.zip"
-        hgtfile = os.path.join(fdir, tile[:7] + ".hgt")
+        zippath = infile + ".hgt.zip"
+        datafile = os.path.join(fdir, tile[:7] + ".hgt")
     else:
-        zipfile = infile + ".raw.zip"
-        rawfile = os.path.join(fdir, tile[:7] + ".raw")
-
-    if os.path.isfile(zipfile):
-        # check if we have unzip
-        if not grass.find_program('unzip'):
-            grass.fatal(_('The "unzip" program is required, please install it first'))
-
-        # really a ZIP file?
-        # make it quiet in a safe way (just in case -qq isn't portable)
-        tenv = os.environ.copy()
-        tenv['UNZIP'] = '-qq'
-        if grass.call(['unzip', '-t', zipfile], env=tenv) != 0:
-            grass.fatal(_("'%s' does not appear to be a valid zip file.") % zipfile)
-        is_zip = True
-
-    elif not water:
-        os.path.isfile(hgtfile)
-        # try and see if it's already unzipped
-        is_zip = False
+        zippath = infile + ".raw.zip"
+        datafile = os.path.join(fdir, tile[:7] + ".raw")
+
+    if os.path.isfile(zippath):
+        if inproc:
+            # the CRC is checked while reading the member
+            if not zipfile.is_zipfile(zippath):
+                grass.fatal(_("'%s' does not appear to be a valid zip file.") % zippath)
+        else:
+            # check if we have unzip
+            if not grass.find_program('unzip'):
+                grass.fatal(_('The "unzip" program is required, please install it first'))
+
+            # really a ZIP file?
+            # make it quiet in a safe way (just in case -qq isn't portable)
+            tenv = os.environ.copy()
+            tenv['UNZIP'] = '-qq'
+            if grass.call(['unzip', '-t', zippath], env=tenv) != 0:
+                grass.fatal(_("'%s' does not appear to be a valid zip file.") % zippath)
+        return tile, zippath, True
 
-    elif os.path.isfile(rawfile):
+    elif os.path.isfile(datafile):
         # try and see if it's already unzipped
-        is_zip = False
+        return tile, datafile, False
 
+    grass.fatal(_("File '%s' or '%s' not found") % (zippath, datafile))
+
+
+def cog_path(cog, output):
+    """Return the name of the GeoTIFF of output in directory cog"""
+    if not cog:
+        return None
+    return os.path.join(cog, output + '.tif')
+
+
+def import_tile(infile, tileout, one, water, inproc=False, native=False,
+                region=None, cache=None, swbd=None, swbd_method='flatten',
+                maskout=None, cog=None):
+    """Import one tile
+
+    If region is given (a dict as returned by grass.region()) only the
+    cells of the tile overlapping it are imported. If cache is given (an
+    ImportCache) the map is restored from it if the same file was
+    imported with the same parameters before, and added to it otherwise.
+    If swbd is given, water cells of the matching SWBD tile are treated
+    according to swbd_method (see import_combined()). If cog is given, a
+    Cloud-Optimized GeoTIFF <tileout>.tif is written into that directory.
+    """
+    if native:
+        # the native reader streams zip members itself
+        inproc = True
+
+    tile, path, is_zip = locate_tile(infile, water, inproc)
+    if swbd:
+        swbd_tile, swbd_path, swbd_is_zip = locate_tile(swbd, True, inproc)
+
+    # the cache holds the raster map only
+    if cache and (maskout or cog):
+        cache = None
+
+    if cache:
+        extra = ()
+        if swbd:
+            extra = (cache.checksum(swbd_path), swbd_method)
+        key = cache.key(path, one, water, native, region, extra)
+        if cache.restore(key, tileout):
+            grass.raster_history(tileout)
+            grass.message(_("Done: restored map <%s> from cache") % tileout)
+            return
+
+    if one or water:
+        grass.message(_("Attempting to import 1-arcsec data."))
+
+    if swbd:
+        if not import_combined(tile, path, is_zip, swbd_path, swbd_is_zip,
+                               tileout, one, swbd_method, maskout, region,
+                               cog_path(cog, tileout)):
+            grass.message(_("Tile <%s> does not overlap the current region, skipped") % tile)
+            return
+    elif native:
+        if not import_native(tile, path, is_zip, tileout, one, water, region,
+                             cog_path(cog, tileout)):
+            grass.message(_("Tile <%s> does not overlap the current region, skipped") % tile)
+            return
     else:
-        grass.fatal(_("File '%s' or '%s' or '%s' not found") % (zipfile, hgtfile, rawfile))
+        import_gdal(tile, path, is_zip, tileout, one, water, inproc, region)
+
+    # nice color table
+    grass.run_command('r.colors', map=tileout, color='srtm')
+
+    # write cmd history:
+    grass.raster_history(tileout)
+
+    if cache:
+        cache.store(key, tileout, tile)
+
+    grass.message(_("Done: generated map ") + tileout)
+
+
+def import_gdal(tile, path, is_zip, tileout, one, water, inproc, region=None):
+    """Import a tile through a BIL header with r.in.gdal (RAW: r.in.bin)"""
+    if water:
+        datafile = tile[:7] + ".raw"
+    else:
+        datafile = tile[:7] + ".hgt"
 
     # make a temporary directory
     tmpdir = grass.tempfile()
     grass.try_remove(tmpdir)
     os.mkdir(tmpdir)
+    tmpdirs.append(tmpdir)
+
+    try:
+        hgtfile = os.path.join(tmpdir, tile[:7] + ".hgt")
+        bilfile = os.path.join(tmpdir, tile + ".bil")
+        rawfile = os.path.join(tmpdir, tile[:7] + ".raw")
 
-    if is_zip:
         if not water:
-            shutil.copyfile(zipfile, os.path.join(tmpdir, tile + ".hgt.zip"))
+            datatmp = bilfile
         else:
-            shutil.copyfile(zipfile, os.path.join(tmpdir, tile + ".raw.zip"))
+            datatmp = rawfile
+
+        if inproc:
+            # decompress or link straight to the name read by the import
+            if is_zip:
+                grass.message(_("Extracting '%s'...") % path)
+                extract_member(path, datafile, datatmp)
+            else:
+                link_or_copy(path, datatmp)
+
+        else:
+            if is_zip:
+                if not water:
+                    zipfile_tmp = os.path.join(tmpdir, tile + ".hgt.zip")
+                else:
+                    zipfile_tmp = os.path.join(tmpdir, tile + ".raw.zip")
+                shutil.copyfile(path, zipfile_tmp)
+
+                # unzip & rename data file:
+                grass.message(_("Extracting '%s'...") % path)
+                tenv = os.environ.copy()
+                tenv['UNZIP'] = '-qq'
+                if grass.call(['unzip', zipfile_tmp], env=tenv, cwd=tmpdir) != 0:
+                    grass.fatal(_("Unable to unzip file."))
+
+            else:
+                if not water:
+                    shutil.copyfile(path, hgtfile)
+                else:
+                    shutil.copyfile(path, rawfile)
+
+            if not water:
+                grass.message(_("Converting input file to BIL..."))
+                os.rename(hgtfile, bilfile)
+
+        ll_latitude, ll_longitude = tile_origin(tile)
+
+        if water:
+            # Calculate Upper Left from Lower Left
+            ulxmap = "%.1f" % (ll_longitude + 1)
+
+            # SRTM90 tile size is 1 deg:
+            ulymap = "%.1f" % (ll_latitude + 1)
+
+        else:
+            # Calculate Upper Left from Lower Left
+            ulxmap = "%.1f" % ll_longitude
+
+            # SRTM90 tile size is 1 deg:
+            ulymap = "%.1f" % (ll_latitude + 1)
+
+        if one or water:
+            tmpl = tmpl1sec
+
+        else:
+            tmpl = tmpl3sec
+
+        header = tmpl % (ulxmap, ulymap)
+        hdrfile = os.path.join(tmpdir, tile + '.hdr')
+        outf = open(hdrfile, 'w')
+        outf.write(header)
+        outf.close()
+
+        # create prj file: To be precise, we would need EGS96! But who really cares...
+        prjfile = os.path.join(tmpdir, tile + '.prj')
+        outf = open(prjfile, 'w')
+        outf.write(proj)
+        outf.close()
 
-    else:
         if not water:
-            shutil.copyfile(hgtfile, os.path.join(tmpdir, tile + ".hgt"))
+            if region:
+                gdal_flags = 'r'
+            else:
+                gdal_flags = ''
+            try:
+                grass.run_command('r.in.gdal', input=bilfile, output=tileout,
+                                  flags=gdal_flags)
+            except CalledModuleError:
+                grass.fatal(_("Unable to import data"))
+
         else:
-            shutil.copyfile(rawfile, os.path.join(tmpdir, tile + ".raw"))
+            # If water, these operations are required
+            swbd_res = 0.000277777777777778  # 0:00:01
 
-    # change to temporary directory
-    os.chdir(tmpdir)
-    in_temp = True
+            n = float(ulymap) + (0.5 * swbd_res)
+            s = float(ll_latitude) - (0.5 * swbd_res)
+            e = float(ulxmap) + (0.5 * swbd_res)
+            w = int(ll_longitude) - (0.5 * swbd_res)
 
-    if not water:
-        zipfile = tile + ".hgt.zip"
+            try:
+                grass.run_command('r.in.bin', input=rawfile, output=tileout,
+                                  bytes=1, north=n, south=s, east=e, west=w,
+                                  rows=3601, cols=3601)
+            except CalledModuleError:
+                grass.fatal(_("Unable to import data"))
+
+    finally:
+        cleanup_tile(tmpdir)
+
+
+class TileReader(object):
+    """Row access to the grid of a HGT (int16) or RAW (uint8) tile
+
+    Unzipped tiles are memory-mapped, zipped tiles are streamed row by
+    row from the archive member, which verifies its CRC at the end.
+    """
+    def __init__(self, path, is_zip, size, water):
+        if water:
+            self.dtype = np.dtype('u1')
+            member = os.path.basename(strip_extension(path))[:7] + '.raw'
+        else:
+            self.dtype = np.dtype('>i2')
+            member = os.path.basename(strip_extension(path))[:7] + '.hgt'
+        self.path = path
+        self.size = size
+        self.archive = None
+        self.stream = None
+        self.data = None
+        nbytes = size * size * self.dtype.itemsize
+
+        if is_zip:
+            try:
+                self.archive = zipfile.ZipFile(path)
+                info = self.archive.getinfo(find_member(self.archive, member))
+                self.check_size(info.file_size, nbytes)
+                self.stream = self.archive.open(info)
+            except (zipfile.BadZipfile, zlib.error) as e:
+                self.close()
+                grass.fatal(_("'%s' does not appear to be a valid zip file: %s") % (path, e))
+            self.next_row = 0
+        else:
+            self.check_size(os.path.getsize(path), nbytes)
+            self.data = np.memmap(path, dtype=self.dtype, mode='r',
+                                  shape=(size, size))
+
+    def check_size(self, filesize, nbytes):
+        if filesize != nbytes:
+            self.close()
+            grass.fatal(_("'%s' has %d bytes instead of %d; check the -1 flag")
+                        % (self.path, filesize, nbytes))
+
+    def rows(self, start=0, stop=None, col_start=0, col_stop=None, step=1):
+        """Yield the rows start to stop of the tile from north to south
+
+        Only the columns col_start to col_stop are returned; with step > 1
+        only every step-th row and column. Memory-mapped tiles read just
+        the pages of this window. Zip members can only be decompressed
+        sequentially: rows before start are skipped and the member is not
+        read beyond stop (its CRC is then not verified).
+        """
+        if stop is None:
+            stop = self.size
+        if col_stop is None:
+            col_stop = self.size
+
+        if self.data is not None:
+            for row in range(start, stop, step):
+                yield self.data[row, col_start:col_stop:step]
+            return
+
+        rowbytes = self.size * self.dtype.itemsize
+        try:
+            while self.next_row < stop:
+                buf = self.stream.read(rowbytes)
+                if len(buf) != rowbytes:
+                    grass.fatal(_("Unexpected end of data in '%s'") % self.path)
+                row = self.next_row
+                self.next_row += 1
+                if row >= start and (row - start) % step == 0:
+                    yield np.frombuffer(buf, dtype=self.dtype)[col_start:col_stop:step]
+        except (zipfile.BadZipfile, zlib.error) as e:
+            grass.fatal(_("'%s' does not appear to be a valid zip file: %s") % (self.path, e))
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+        # drop the memory map
+        self.data = None
+
+
+class GeoTiffWriter(object):
+    """Write rows of CELL values into a Cloud-Optimized GeoTIFF
+
+    Rows of at most MEM_CELLS cells (one 1-arcsec tile) go to an
+    in-memory dataset; larger outputs, e.g. mosaics, are staged in a
+    tiled GeoTIFF next to the output, so the memory used stays within
+    the GDAL block cache. The staged rows are written once on close() as
+    DEFLATE compressed COG (with the COG driver of GDAL >= 3.1, which
+    builds the overviews, otherwise as tiled GeoTIFF with the overviews
+    copied in front of the data).
+    """
+    def __init__(self, path, north, south, east, west, nrows, ncols):
+        self.path = path
+        self.nrows = nrows
+        self.ncols = ncols
+        self.row = 0
+        if nrows * ncols <= MEM_CELLS:
+            self.staging = None
+            self.dataset = gdal.GetDriverByName('MEM').Create(
+                '', ncols, nrows, 1, gdal.GDT_Int16)
+        else:
+            self.staging = path + '.tmp.tif'
+            self.dataset = gdal.GetDriverByName('GTiff').Create(
+                self.staging, ncols, nrows, 1, gdal.GDT_Int16,
+                options=['TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512',
+                         'COMPRESS=DEFLATE', 'PREDICTOR=2', 'BIGTIFF=IF_SAFER'])
+        if self.dataset is None:
+            grass.fatal(_("Unable to create '%s'") % path)
+        self.dataset.SetGeoTransform((west, (east - west) / ncols, 0,
+                                      north, 0, -(north - south) / nrows))
+        self.dataset.SetProjection(proj)
+        self.band = self.dataset.GetRasterBand(1)
+        self.band.SetNoDataValue(HGT_NODATA)
+
+    def put_row(self, row):
+        values = np.where(row == CELL_NULL, HGT_NODATA, row).astype(np.int16)
+        self.band.WriteArray(values.reshape(1, -1), 0, self.row)
+        self.row += 1
+
+    def close(self):
+        options = ['COMPRESS=DEFLATE', 'PREDICTOR=2', 'BIGTIFF=IF_SAFER']
+        cog = gdal.GetDriverByName('COG')
+        try:
+            if cog is not None:
+                result = cog.CreateCopy(self.path, self.dataset,
+                                        options=options + ['BLOCKSIZE=512'])
+            else:
+                levels = []
+                factor = 2
+                while max(self.nrows, self.ncols) // factor >= 256:
+                    levels.append(factor)
+                    factor *= 2
+                if levels:
+                    self.dataset.BuildOverviews('AVERAGE', levels)
+                result = gdal.GetDriverByName('GTiff').CreateCopy(
+                    self.path, self.dataset,
+                    options=options + ['TILED=YES', 'BLOCKXSIZE=512',
+                                       'BLOCKYSIZE=512', 'COPY_SRC_OVERVIEWS=YES'])
+            if result is None:
+                grass.fatal(_("Unable to write '%s'") % self.path)
+            result = None
+        finally:
+            self.abort()
+
+    def abort(self):
+        self.band = None
+        self.dataset = None
+        if self.staging:
+            gdal.GetDriverByName('GTiff').Delete(self.staging)
+            self.staging = None
+
+
+def write_raster(rows, output, north, south, east, west, nrows, ncols,
+                 nodata=None, cog=None):
+    """Write rows of integers north to south into a new CELL raster map
+
+    The raster window of this process is set to the given bounds, the
+    current region of the mapset is not changed. Cells equal to nodata
+    are written as null. If cog is given, the rows are also written into
+    a Cloud-Optimized GeoTIFF of that name in the same pass.
+    """
+    region = Region()
+    region.north = north
+    region.south = south
+    region.east = east
+    region.west = west
+    region.rows = nrows
+    region.cols = ncols
+    region.adjust(rows=True, cols=True)
+    region.set_raster_region()
+
+    if cog:
+        tif = GeoTiffWriter(cog, north, south, east, west, nrows, ncols)
     else:
-        zipfile = tile + ".raw.zip"
+        tif = None
 
-    hgtfile = tile[:7] + ".hgt"
-    bilfile = tile + ".bil"
-    rawfile = tile[:7] + ".raw"
+    buf = Buffer((ncols,), mtype='CELL')
+    raster = RasterRow(output)
+    raster.open('w', mtype='CELL', overwrite=grass.overwrite())
+    try:
+        for row in rows:
+            buf[:] = row
+            if nodata is not None:
+                buf[row == nodata] = CELL_NULL
+            raster.put_row(buf)
+            if tif:
+                tif.put_row(buf)
+    except Exception:
+        if tif:
+            tif.abort()
+        raise
+    finally:
+        raster.close()
+    if tif:
+        tif.close()
 
-    if is_zip:
-        # unzip & rename data file:
-        grass.message(_("Extracting '%s'...") % zipfile)
-        if grass.call(['unzip', zipfile], env=tenv) != 0:
-            grass.fatal(_("Unable to unzip file."))
 
-    if not water:
-        grass.message(_("Converting input file to BIL..."))
-        os.rename(hgtfile, bilfile)
+def tile_window(north, west, size, res, region, ncols=None):
+    """Return the rows and columns of a tile overlapping a region
 
-    north = tile[0]
-    ll_latitude = int(tile[1:3])
-    east = tile[3]
-    ll_longitude = int(tile[4:7])
+    north and west are the outer edges of the tile, which has size rows
+    and ncols (default: size) columns. Returns
+    (row_start, row_stop, col_start, col_stop), or None if the tile does
+    not overlap the region.
+    """
+    if ncols is None:
+        ncols = size
+    if not region:
+        return (0, size, 0, ncols)
 
-    # are we on the southern hemisphere? If yes, make LATITUDE negative.
-    if north == "S":
-        ll_latitude *= -1
+    # snap to the tile grid, the region edges need not be aligned
+    eps = 1e-6
+    row_start = max(0, int(math.floor((north - float(region['n'])) / res + eps)))
+    row_stop = min(size, int(math.ceil((north - float(region['s'])) / res - eps)))
+    col_start = max(0, int(math.floor((float(region['w']) - west) / res + eps)))
+    col_stop = min(ncols, int(math.ceil((float(region['e']) - west) / res - eps)))
 
-    # are we west of Greenwich? If yes, make LONGITUDE negative.
-    if east == "W":
-        ll_longitude *= -1
+    if row_start >= row_stop or col_start >= col_stop:
+        return None
+    return (row_start, row_stop, col_start, col_stop)
+
+
+def import_native(tile, path, is_zip, tileout, one, water, region=None,
+                  cog=None):
+    """Decode a tile with NumPy and write the raster map directly
+
+    Returns False if the tile does not overlap region.
+    """
+    if not grass.overwrite() and \
+            grass.find_file(tileout, element='cell', mapset='.')['file']:
+        grass.fatal(_("Raster map <%s> already exists") % tileout)
+
+    ll_latitude, ll_longitude = tile_origin(tile)
+    size = tile_size(one, water)
+    res = 1.0 / (size - 1)
+
+    # SRTM coordinates refer to cell centers, GRASS to cell edges
+    north = ll_latitude + 1 + 0.5 * res
+    west = ll_longitude - 0.5 * res
+
+    window = tile_window(north, west, size, res, region)
+    if window is None:
+        return False
+    row_start, row_stop, col_start, col_stop = window
 
     if water:
-        # Calculate Upper Left from Lower Left
-        ulxmap = "%.1f" % (ll_longitude + 1)
+        nodata = None
+    else:
+        nodata = HGT_NODATA
+
+    reader = TileReader(path, is_zip, size, water)
+    try:
+        write_raster(reader.rows(*window), tileout,
+                     north - row_start * res, north - row_stop * res,
+                     west + col_stop * res, west + col_start * res,
+                     row_stop - row_start, col_stop - col_start, nodata, cog)
+    finally:
+        reader.close()
+    return True
 
-        # SRTM90 tile size is 1 deg:
-        ulymap = "%.1f" % (ll_latitude + 1)
 
+def import_combined(tile, path, is_zip, swbd_path, swbd_is_zip, tileout,
+                    one, method='flatten', maskout=None, region=None,
+                    cog=None):
+    """Decode a HGT tile and the matching SWBD tile in one pass
+
+    Water cells of the elevation are set to null (method 'null') or to
+    the lowest valid elevation of their water body (method 'flatten').
+    The water mask (1: water, 0: land) is written to maskout if given.
+    SWBD tiles are 1-arcsec, for 3-arcsec elevation every third cell of
+    the SWBD grid is used. Returns False if the tile does not overlap
+    region.
+    """
+    for name in (tileout, maskout):
+        if name and not grass.overwrite() and \
+                grass.find_file(name, element='cell', mapset='.')['file']:
+            grass.fatal(_("Raster map <%s> already exists") % name)
+
+    ll_latitude, ll_longitude = tile_origin(tile)
+    size = tile_size(one, False)
+    res = 1.0 / (size - 1)
+    swbd_size = tile_size(True, True)
+    step = (swbd_size - 1) // (size - 1)
+
+    # SRTM coordinates refer to cell centers, GRASS to cell edges
+    north = ll_latitude + 1 + 0.5 * res
+    west = ll_longitude - 0.5 * res
+
+    window = tile_window(north, west, size, res, region)
+    if window is None:
+        return False
+    row_start, row_stop, col_start, col_stop = window
+    nrows = row_stop - row_start
+    ncols = col_stop - col_start
+
+    elevation = np.empty((nrows, ncols), dtype=np.int32)
+    water = np.empty((nrows, ncols), dtype=bool)
+
+    reader = TileReader(path, is_zip, size, False)
+    swbd_reader = TileReader(swbd_path, swbd_is_zip, swbd_size, True)
+    try:
+        rows = zip(reader.rows(*window),
+                   swbd_reader.rows(row_start * step, (row_stop - 1) * step + 1,
+                                    col_start * step, (col_stop - 1) * step + 1,
+                                    step))
+        for i, (values, swbd) in enumerate(rows):
+            elevation[i] = values
+            water[i] = swbd != 0
+    finally:
+        reader.close()
+        swbd_reader.close()
+
+    elevation[elevation == HGT_NODATA] = CELL_NULL
+    if method == 'null':
+        elevation[water] = CELL_NULL
     else:
-        # Calculate Upper Left from Lower Left
-        ulxmap = "%.1f" % ll_longitude
+        labels, count = ndimage.label(water)
+        if count:
+            maxint = np.iinfo(np.int32).max
+            levels = np.asarray(ndimage.minimum(
+                np.where(elevation == CELL_NULL, maxint, elevation),
+                labels, np.arange(1, count + 1)))
+            levels[levels == maxint] = CELL_NULL
+            levels = np.concatenate(([0], levels)).astype(np.int32)
+            elevation[water] = levels[labels[water]]
 
-        # SRTM90 tile size is 1 deg:
-        ulymap = "%.1f" % (ll_latitude + 1)
+    bounds = (north - row_start * res, north - row_stop * res,
+              west + col_stop * res, west + col_start * res, nrows, ncols)
+    write_raster(elevation, tileout, *bounds, cog=cog)
+    if maskout:
+        write_raster(water.astype(np.int32), maskout, *bounds)
+        grass.raster_history(maskout)
+    return True
 
-    if one or water:
-        grass.message(_("Attempting to import 1-arcsec data."))
-        tmpl = tmpl1sec
 
+def mosaic_rows(tiles, water, top, left, size, window):
+    """Yield the rows of a mosaic of tiles north to south as CELL values
+
+    tiles is a list of (path, is_zip, ll_latitude, ll_longitude) and top,
+    left the latitude and longitude of the upper left cell center of the
+    mosaic. Adjacent tiles share their edge row and column: the cells of
+    the edge are taken from the first tile with a valid value there, so
+    the duplicate is dropped and nodata is resolved across the seam.
+    Tiles are opened when the first of their rows is reached and closed
+    after their last row.
+    """
+    row_start, row_stop, col_start, col_stop = window
+    step = size - 1
+    out = np.empty(col_stop - col_start, dtype=np.int32)
+
+    # mosaic row and column of the upper left cell of each tile
+    pending = sorted(((top - (lat + 1)) * step, (lon - left) * step, path, is_zip)
+                     for path, is_zip, lat, lon in tiles)
+    active = []
+    try:
+        for row in range(row_start, row_stop):
+            while pending and pending[0][0] <= row:
+                trow, tcol, path, is_zip = pending.pop(0)
+                first = max(col_start, tcol)
+                last = min(col_stop, tcol + size)
+                if trow + size <= row or first >= last:
+                    continue
+                reader = TileReader(path, is_zip, size, water)
+                rows = reader.rows(row - trow, min(row_stop - trow, size),
+                                   first - tcol, last - tcol)
+                active.append((trow + size, first - col_start,
+                               last - col_start, reader, rows))
+
+            out.fill(CELL_NULL)
+            for tile in active:
+                values = next(tile[4]).astype(np.int32)
+                if not water:
+                    values[values == HGT_NODATA] = CELL_NULL
+                dst = out[tile[1]:tile[2]]
+                np.copyto(dst, values, where=dst == CELL_NULL)
+            yield out
+
+            for tile in [t for t in active if t[0] <= row + 1]:
+                tile[3].close()
+                active.remove(tile)
+    finally:
+        for tile in active:
+            tile[3].close()
+
+
+def import_mosaic(tiles, output, water, region=None, cog=None):
+    """Decode several tiles into one raster map in a single pass
+
+    tiles is a list of (infile, tile, one). If cog is given, the mosaic is
+    also written as Cloud-Optimized GeoTIFF <output>.tif into directory
+    cog.
+    """
+    if not grass.overwrite() and \
+            grass.find_file(output, element='cell', mapset='.')['file']:
+        grass.fatal(_("Raster map <%s> already exists") % output)
+
+    sizes = set(tile_size(one, water) for infile, tile, one in tiles)
+    if len(sizes) > 1:
+        grass.fatal(_("Tiles of different resolution cannot be mosaicked"))
+    size = sizes.pop()
+    res = 1.0 / (size - 1)
+
+    located = []
+    for infile, tile, one in tiles:
+        tile, path, is_zip = locate_tile(infile, water, True)
+        ll_latitude, ll_longitude = tile_origin(tile)
+        located.append((path, is_zip, ll_latitude, ll_longitude))
+
+    top = max(t[2] for t in located) + 1
+    bottom = min(t[2] for t in located)
+    left = min(t[3] for t in located)
+    right = max(t[3] for t in located) + 1
+    nrows = (top - bottom) * (size - 1) + 1
+    ncols = (right - left) * (size - 1) + 1
+
+    # SRTM coordinates refer to cell centers, GRASS to cell edges
+    north = top + 0.5 * res
+    west = left - 0.5 * res
+
+    window = tile_window(north, west, nrows, res, region, ncols)
+    if window is None:
+        grass.fatal(_("The tiles do not overlap the current region"))
+    row_start, row_stop, col_start, col_stop = window
+
+    grass.message(_("Mosaicking %d tiles into <%s>...") % (len(tiles), output))
+    write_raster(mosaic_rows(located, water, top, left, size, window), output,
+                 north - row_start * res, north - row_stop * res,
+                 west + col_stop * res, west + col_start * res,
+                 row_stop - row_start, col_stop - col_start,
+                 cog=cog_path(cog, output))
+
+    # nice color table
+    grass.run_command('r.colors', map=output, color='srtm')
+
+    # write cmd history:
+    grass.raster_history(output)
+    grass.message(_("Done: generated map ") + output)
+
+
+def file_checksum(path):
+    """Return the SHA-1 hex digest of the content of a file"""
+    digest = hashlib.sha1()
+    f = open(path, 'rb')
+    try:
+        while True:
+            buf = f.read(1024 * 1024)
+            if not buf:
+                break
+            digest.update(buf)
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+
+def tile_info(path):
+    """Return (product, arcsec) of a HGT/RAW tile, detected from its size
+
+    Returns None if the size does not match any SRTM product.
+    """
+    if path.lower().endswith('.zip'):
+        # .hgt.zip holds a .hgt member, .raw.zip a .raw member
+        ext = path[-8:-4].lower()
+        archive = zipfile.ZipFile(path)
+        try:
+            sizes = [info.file_size for info in archive.infolist()
+                     if info.filename.lower().endswith(ext)]
+        finally:
+            archive.close()
+        if not sizes:
+            return None
+        nbytes = sizes[0]
     else:
-        tmpl = tmpl3sec
+        nbytes = os.path.getsize(path)
+    return TILE_BYTES.get(nbytes)
 
-    header = tmpl % (ulxmap, ulymap)
-    hdrfile = tile + '.hdr'
-    outf = file(hdrfile, 'w')
-    outf.write(header)
-    outf.close()
 
-    # create prj file: To be precise, we would need EGS96! But who really cares...
-    prjfile = tile + '.prj'
-    outf = file(prjfile, 'w')
-    outf.write(proj)
-    outf.close()
+def open_catalog(path):
+    """Open (and create) the tile catalog"""
+    db = sqlite3.connect(path)
+    db.execute("""CREATE TABLE IF NOT EXISTS tiles (
+                      path TEXT PRIMARY KEY,
+                      tile TEXT NOT NULL,
+                      product TEXT NOT NULL,
+                      arcsec INTEGER NOT NULL,
+                      north REAL NOT NULL,
+                      south REAL NOT NULL,
+                      east REAL NOT NULL,
+                      west REAL NOT NULL,
+                      bytes INTEGER NOT NULL,
+                      mtime REAL NOT NULL,
+                      checksum TEXT NOT NULL)""")
+    db.execute("""CREATE INDEX IF NOT EXISTS tiles_bounds
+                  ON tiles (product, south, north, west, east)""")
+    return db
 
-    if not water:
+
+def catalog_files(input):
+    """List HGT/RAW tiles in input, directories are searched recursively"""
+    exts = ('.hgt', '.hgt.zip', '.raw', '.raw.zip')
+    paths = []
+    for item in input.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if os.path.isdir(item):
+            for dirpath, dirnames, filenames in os.walk(item):
+                dirnames.sort()
+                paths.extend(os.path.join(dirpath, name)
+                             for name in sorted(filenames)
+                             if name.lower().endswith(exts))
+        elif any(c in item for c in '*?['):
+            paths.extend(name for name in sorted(glob.glob(item))
+                         if name.lower().endswith(exts))
+        else:
+            paths.append(item)
+    return [os.path.abspath(path) for path in paths]
+
+
+def update_catalog(db, input):
+    """Add new and changed tiles of input to the catalog
+
+    Tiles whose size and modification time are unchanged are not read
+    again, catalog entries of removed files in input are deleted. Files
+    that are not named like SRTM tiles are skipped.
+    """
+    known = dict((row[0], (row[1], row[2])) for row in
+                 db.execute("SELECT path, bytes, mtime FROM tiles"))
+    dirs = [os.path.abspath(item.strip()) + os.sep
+            for item in input.split(',') if os.path.isdir(item.strip())]
+
+    paths = catalog_files(input)
+    added = 0
+    for i, path in enumerate(paths):
+        grass.percent(i, len(paths), 5)
+        if not TILE_NAME.match(os.path.basename(path)):
+            grass.warning(_("<%s> is not named like an SRTM tile, skipped") % path)
+            continue
         try:
-            grass.run_command('r.in.gdal', input=bilfile, output=tileout)
-        except:
-            grass.fatal("Unable to import data")
+            stat = os.stat(path)
+        except OSError:
+            grass.warning(_("File '%s' not found") % path)
+            continue
+        if known.get(path) == (stat.st_size, stat.st_mtime):
+            continue
+
+        try:
+            info = tile_info(path)
+        except (zipfile.BadZipfile, zlib.error) as e:
+            grass.warning(_("'%s' skipped: %s") % (path, e))
+            continue
+        if info is None:
+            grass.warning(_("'%s' is no SRTM HGT/RAW tile, skipped") % path)
+            continue
+
+        product, arcsec = info
+        tile = os.path.basename(strip_extension(path))[:7]
+        ll_latitude, ll_longitude = tile_origin(tile)
+        res = arcsec / 3600.0
+        db.execute("INSERT OR REPLACE INTO tiles VALUES "
+                   "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                   (path, tile, product, arcsec,
+                    ll_latitude + 1 + 0.5 * res, ll_latitude - 0.5 * res,
+                    ll_longitude + 1 + 0.5 * res, ll_longitude - 0.5 * res,
+                    stat.st_size, stat.st_mtime, file_checksum(path)))
+        added += 1
+    grass.percent(1, 1, 1)
 
+    removed = 0
+    for path in known:
+        if any(path.startswith(d) for d in dirs) and not os.path.isfile(path):
+            db.execute("DELETE FROM tiles WHERE path = ?", (path,))
+            removed += 1
+    db.commit()
+
+    count = db.execute("SELECT count(*) FROM tiles").fetchone()[0]
+    grass.message(_("Tile catalog: %d tiles added or updated, %d removed, "
+                    "%d in total") % (added, removed, count))
+
+
+def query_catalog(db, water, region):
+    """Return (path, tile, arcsec) of the catalog tiles overlapping region
+
+    Each tile is returned once, preferring 1-arcsec over 3-arcsec data.
+    """
+    if water:
+        product = 'SWBD'
     else:
-        # If water, these operations are required
-        swbd_res = 0.000277777777777778  # 0:00:01
+        product = 'HGT'
+    rows = db.execute("SELECT path, tile, arcsec FROM tiles "
+                      "WHERE product = ? AND north > ? AND south < ? "
+                      "AND east > ? AND west < ? ORDER BY tile, arcsec, path",
+                      (product, float(region['s']), float(region['n']),
+                       float(region['w']), float(region['e'])))
+    tiles = []
+    seen = set()
+    for path, tile, arcsec in rows:
+        if tile not in seen:
+            seen.add(tile)
+            tiles.append((path, tile, arcsec))
+    return tiles
 
-        n = float(ulymap) + (0.5 * swbd_res)
-        s = float(ll_latitude) - (0.5 * swbd_res)
-        e = float(ulxmap) + (0.5 * swbd_res)
-        w = int(ll_longitude) - (0.5 * swbd_res)
 
+class ImportCache(object):
+    """Cache of imported tiles, addressed by input checksum and parameters
+
+    Imported maps are kept as r.pack archives in a directory, together
+    with an SQLite index of their size and last use. Restoring a map with
+    r.unpack copies the stored raster files instead of decoding the tile
+    again. The least recently used archives are removed when the cache
+    grows beyond maxsize MB.
+
+    The checksums of the input files are taken from checksums, a dict of
+    (size, mtime, checksum) by real path filled from the tile catalog,
+    while the size and modification time still match; otherwise the file
+    is hashed.
+    """
+    def __init__(self, path, maxsize):
+        self.path = os.path.abspath(path)
+        self.maxsize = maxsize * 1024 * 1024
+        self.checksums = {}
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def checksum(self, path):
+        """Return the SHA-1 checksum of the content of path"""
+        realpath = os.path.realpath(path)
+        stat = os.stat(realpath)
+        known = self.checksums.get(realpath)
+        if known is None or known[:2] != (stat.st_size, stat.st_mtime):
+            known = (stat.st_size, stat.st_mtime, file_checksum(realpath))
+            self.checksums[realpath] = known
+        return known[2]
+
+    def connect(self):
+        # several import processes may share the cache
+        db = sqlite3.connect(os.path.join(self.path, 'cache.db'), timeout=60)
+        db.execute("""CREATE TABLE IF NOT EXISTS entries (
+                          key TEXT PRIMARY KEY,
+                          tile TEXT NOT NULL,
+                          bytes INTEGER NOT NULL,
+                          created REAL NOT NULL,
+                          used REAL NOT NULL)""")
+        return db
+
+    def key(self, path, one, water, native, region=None, extra=()):
+        """Return the cache key of importing path with these parameters
+
+        The input is identified by the checksum of its content, so a
+        copy or a moved tile is found too; the key includes the reader
+        (native or GDAL) and the extent and resolution of the region.
+        """
+        params = [self.checksum(path), str(int(bool(one))),
+                  str(int(bool(water))), 'native' if native else 'gdal']
+        if region:
+            params.extend(str(region[k]) for k in ('n', 's', 'e', 'w',
+                                                   'nsres', 'ewres'))
+        params.extend(extra)
+        return hashlib.sha1('|'.join(params).encode('ascii')).hexdigest()
+
+    def packfile(self, key):
+        return os.path.join(self.path, key + '.pack')
+
+    def restore(self, key, output):
+        """Restore the cached map of key as output, return False on a miss"""
+        packfile = self.packfile(key)
+        db = self.connect()
         try:
-            grass.run_command('r.in.bin', input=rawfile, output=tileout,
-                              bytes=1, north=n, south=s, east=e, west=w,
-                              rows=3601, cols=3601)
-        except:
-            grass.fatal(_("Unable to import data"))
+            found = db.execute("SELECT key FROM entries WHERE key = ?",
+                               (key,)).fetchone()
+            if not found or not os.path.isfile(packfile):
+                return False
+            db.execute("UPDATE entries SET used = ? WHERE key = ?",
+                       (time.time(), key))
+            db.commit()
+        finally:
+            db.close()
 
-    # nice color table
-    grass.run_command('r.colors', map=tileout, color='srtm')
+        try:
+            grass.run_command('r.unpack', input=packfile, output=output,
+                              quiet=True)
+        except CalledModuleError:
+            grass.warning(_("Unable to restore <%s> from cache, importing again") % output)
+            return False
+        return True
 
-    # write cmd history:
-    grass.raster_history(tileout)
-    grass.message(_("Done: generated map ") + tileout)
+    def store(self, key, output, tile):
+        """Add the map output to the cache"""
+        packfile = self.packfile(key)
+        tmpfile = packfile + '.%d.tmp' % os.getpid()
+        try:
+            grass.run_command('r.pack', input=output, output=tmpfile,
+                              flags='c', quiet=True)
+        except CalledModuleError:
+            grass.try_remove(tmpfile)
+            grass.warning(_("Unable to add <%s> to cache") % output)
+            return
+        os.rename(tmpfile, packfile)
+
+        now = time.time()
+        db = self.connect()
+        try:
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                       (key, tile, os.path.getsize(packfile), now, now))
+            self.evict(db)
+            db.commit()
+        finally:
+            db.close()
+
+    def evict(self, db):
+        """Remove least recently used entries beyond the maximum size"""
+        total = db.execute("SELECT sum(bytes) FROM entries").fetchone()[0] or 0
+        for key, nbytes in db.execute("SELECT key, bytes FROM entries "
+                                      "ORDER BY used").fetchall():
+            if total <= self.maxsize:
+                break
+            grass.try_remove(self.packfile(key))
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= nbytes
+
+    def entries(self):
+        """Return (key, tile, bytes, created, used) of all entries"""
+        db = self.connect()
+        try:
+            return db.execute("SELECT key, tile, bytes, created, used "
+                              "FROM entries ORDER BY used DESC").fetchall()
+        finally:
+            db.close()
+
+    def purge(self):
+        """Remove all entries"""
+        db = self.connect()
+        try:
+            for (key,) in db.execute("SELECT key FROM entries").fetchall():
+                grass.try_remove(self.packfile(key))
+            db.execute("DELETE FROM entries")
+            db.commit()
+        finally:
+            db.close()
+
+
+def list_cache(cache):
+    total = 0
+    for key, tile, nbytes, created, used in cache.entries():
+        total += nbytes
+        sys.stdout.write("%s|%s|%.1f MB|%s|%s\n" % (
+            tile, key, nbytes / 1048576.0,
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created)),
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(used))))
+    grass.message(_("Cache size: %.1f of %.1f MB") %
+                  (total / 1048576.0, cache.maxsize / 1048576.0))
+
+
+def import_tile_worker(args):
+    """Import one tile, returning an error message instead of exiting
+
+    args are the keyword arguments of import_tile(). Errors, including
+    those of grass.fatal() and of NumPy and GDAL, are returned rather
+    than raised, so one bad tile does not stop the pool.
+    """
+    infile, tileout = args['infile'], args['tileout']
+    raise_on_error = grass.get_raise_on_error()
+    grass.set_raise_on_error(True)
+    try:
+        import_tile(**args)
+    except (ScriptError, CalledModuleError, IOError, OSError, ValueError,
+            AttributeError, RuntimeError) as e:
+        # ValueError: a tile name without latitude and longitude
+        return (infile, tileout, str(e))
+    finally:
+        grass.set_raise_on_error(raise_on_error)
+    return (infile, tileout, None)
+
+
+def main():
+    input = options['input']
+    output = options['output']
+    one = flags['1']
+    water = flags['w']
+    inproc = flags['z']
+    native = not flags['g']
+    nprocs = int(options['nprocs'])
+    if flags['r']:
+        region = grass.region()
+    else:
+        region = None
+    if options['cache']:
+        cache = ImportCache(options['cache'], int(options['cache_size']))
+    else:
+        cache = None
+
+    if flags['l']:
+        list_cache(cache)
+        return
+    if flags['p']:
+        cache.purge()
+        grass.message(_("Cache purged"))
+        return
+
+    # are we in LatLong location?
+    s = grass.read_command("g.proj", flags='j')
+    kv = grass.parse_key_val(s)
+    if kv['+proj'] != 'longlat':
+        grass.fatal(_("This module only operates in LatLong locations"))
+
+    if options['catalog']:
+        db = open_catalog(options['catalog'])
+        try:
+            if input:
+                update_catalog(db, input)
+            if flags['c']:
+                return
+            tiles = [(path, tile, arcsec == 1) for path, tile, arcsec in
+                     query_catalog(db, water, region or grass.region())]
+            if cache:
+                for path, size, mtime, checksum in db.execute(
+                        "SELECT path, bytes, mtime, checksum FROM tiles"):
+                    cache.checksums[os.path.realpath(path)] = (size, mtime, checksum)
+        finally:
+            db.close()
+        if not tiles:
+            grass.fatal(_("No tiles of the catalog overlap the current region"))
+    else:
+        tiles = [(infile, os.path.basename(infile), one)
+                 for infile in expand_input(input, water)]
+        if not tiles:
+            grass.fatal(_("No SRTM tiles found in <%s>") % input)
+
+    if native and not NATIVE:
+        grass.verbose(_("NumPy or pygrass not available, importing with GDAL"))
+        native = False
+    if region and water and not native:
+        grass.warning(_("r.in.bin imports SWBD tiles completely, -r is ignored"))
+
+    cog = options['cog']
+    if cog:
+        if not native or not GDAL:
+            grass.fatal(_("Writing GeoTIFFs requires NumPy, pygrass and the GDAL Python library"))
+        if not os.path.isdir(cog):
+            os.makedirs(cog)
+
+    if options['swbd']:
+        if not native or not SCIPY:
+            grass.fatal(_("Treating water with SWBD requires NumPy, SciPy and pygrass"))
+        swbd_tiles = dict((os.path.basename(infile)[:7], infile)
+                          for infile in expand_input(options['swbd'], True))
+    else:
+        swbd_tiles = None
+
+    if flags['m']:
+        if not NATIVE:
+            grass.fatal(_("Mosaicking requires NumPy and pygrass"))
+        import_mosaic(tiles, output, water, region, cog)
+        return
+
+    jobs = []
+    for infile, tile, one in tiles:
+        if len(tiles) == 1:
+            tileout = output or tile
+        elif output:
+            tileout = output + '_' + tile
+        else:
+            tileout = tile
+        if not output:
+            grass.debug("No output set... using name: " + tileout)
+        if swbd_tiles is None:
+            swbd = None
+        elif tile[:7] in swbd_tiles:
+            swbd = swbd_tiles[tile[:7]]
+        else:
+            grass.warning(_("No SWBD tile found for <%s>, water is not treated") % tile)
+            swbd = None
+        if swbd and flags['s']:
+            maskout = tileout + '_water'
+        else:
+            maskout = None
+        jobs.append(dict(infile=infile, tileout=tileout, one=one, water=water,
+                         inproc=inproc, native=native, region=region,
+                         cache=cache, swbd=swbd,
+                         swbd_method=options['swbd_method'], maskout=maskout,
+                         cog=cog))
+
+    if nprocs > 1 and len(jobs) > 1:
+        grass.message(_("Importing %d tiles with %d processes...") %
+                      (len(jobs), nprocs))
+        pool = multiprocessing.Pool(min(nprocs, len(jobs)))
+        try:
+            results = pool.map(import_tile_worker, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [import_tile_worker(job) for job in jobs]
+
+    failed = [(infile, error) for infile, tileout, error in results if error]
+    for infile, error in failed:
+        grass.warning(_("Tile <%s> not imported: %s") % (infile, error))
+
+    # summary
+    if len(jobs) > 1:
+        grass.message(_("Imported %d of %d tiles") %
+                      (len(jobs) - len(failed), len(jobs)))
+    if failed:
+        grass.fatal(_("%d of %d tiles could not be imported") %
+                    (len(failed), len(jobs)))
 
     if not water:
         grass.message(_("(Note: Holes in the data can be closed with 'r.fillnulls' using splines)"))
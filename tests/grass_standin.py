@@ -0,0 +1,200 @@
+############################################################################
+#
+# MODULE:       grass_standin.py
+# AUTHOR(S):    Jonas Strobel, intern at mundialis and terrestris, Bonn
+# PURPOSE:      Stand-ins for grass.script and grass.pygrass, so the tests
+#               of the scripts run without a GRASS installation
+# COPYRIGHT:    (C) 2017 by stjo, and the GRASS Development Team
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+############################################################################
+"""Stand-ins for grass.script and grass.pygrass
+
+Like the benchmark, the stand-ins are installed in sys.modules before a
+script is loaded with load_script(). They record what the scripts do:
+
+    commands   the modules run with run_command(), as (prog, kwargs)
+    warnings   the messages of warning()
+    maps       the raster maps written with RasterRow, by name, as dict
+               with the rows (array) and the bounds of the raster window
+
+grass.fatal() always raises ScriptError. find_file() finds the maps of
+maps. reset() clears the records between tests.
+"""
+
+import os
+import sys
+import types
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+commands = []
+warnings = []
+maps = {}
+
+
+def reset():
+    del commands[:]
+    del warnings[:]
+    maps.clear()
+
+
+class ScriptError(Exception):
+    pass
+
+
+class CalledModuleError(Exception):
+    pass
+
+
+def install():
+    """Install the stand-ins in sys.modules, once"""
+    if 'grass.script' in sys.modules and \
+            getattr(sys.modules['grass.script'], 'standin', False):
+        return
+
+    grass = types.ModuleType('grass')
+    script = types.ModuleType('grass.script')
+    array = types.ModuleType('grass.script.array')
+    exceptions = types.ModuleType('grass.exceptions')
+    exceptions.CalledModuleError = CalledModuleError
+    exceptions.ScriptError = ScriptError
+    raise_on_error = [False]
+    window = {}
+
+    def fatal(msg):
+        raise ScriptError(msg)
+
+    def run_command(prog, **kwargs):
+        commands.append((prog, kwargs))
+        return 0
+
+    def read_command(prog, **kwargs):
+        commands.append((prog, kwargs))
+        if prog == 'g.proj':
+            return '+proj=longlat\n+datum=WGS84\n'
+        return ''
+
+    def find_file(name, element='cell', mapset=None):
+        if name in maps:
+            return {'file': name, 'name': name, 'mapset': 'PERMANENT'}
+        return {'file': '', 'name': '', 'mapset': ''}
+
+    def ignore(*args, **kwargs):
+        pass
+
+    # grass.script installs the gettext function _() as builtin
+    try:
+        import builtins
+    except ImportError:
+        import __builtin__ as builtins
+    builtins._ = lambda message: message
+
+    script.standin = True
+    script.fatal = fatal
+    script.message = ignore
+    script.warning = warnings.append
+    script.verbose = ignore
+    script.debug = ignore
+    script.percent = ignore
+    script.raster_history = ignore
+    script.use_temp_region = ignore
+    script.del_temp_region = ignore
+    script.overwrite = lambda: True
+    script.find_file = find_file
+    script.set_raise_on_error = lambda value=True: raise_on_error.__setitem__(0, value)
+    script.get_raise_on_error = lambda: raise_on_error[0]
+    script.run_command = run_command
+    script.read_command = read_command
+    script.region = lambda: {'n': 52, 's': 51, 'e': 11, 'w': 10,
+                             'nsres': 1 / 3600., 'ewres': 1 / 3600.}
+    script.array = array
+    grass.script = script
+    grass.exceptions = exceptions
+
+    pygrass = types.ModuleType('grass.pygrass')
+    gis = types.ModuleType('grass.pygrass.gis')
+    region = types.ModuleType('grass.pygrass.gis.region')
+    raster = types.ModuleType('grass.pygrass.raster')
+    buffer_ = types.ModuleType('grass.pygrass.raster.buffer')
+
+    class Region(object):
+        def adjust(self, rows=False, cols=False):
+            pass
+
+        def set_raster_region(self):
+            window.clear()
+            window.update((key, getattr(self, key)) for key in
+                          ('north', 'south', 'east', 'west', 'rows', 'cols'))
+
+    class Buffer(np.ndarray):
+        def __new__(cls, shape, mtype='FCELL', buffer=None):
+            dtype = {'CELL': np.int32, 'FCELL': np.float32,
+                     'DCELL': np.float64}[mtype]
+            return np.ndarray.__new__(cls, shape, dtype, buffer)
+
+    class RasterRow(object):
+        def __init__(self, name, mapset=''):
+            self.name = name
+
+        def open(self, mode='r', mtype=None, overwrite=False):
+            self.rows = []
+            self.window = dict(window)
+
+        def put_row(self, row):
+            self.rows.append(np.array(row))
+
+        def close(self):
+            maps[self.name] = {'rows': np.array(self.rows),
+                               'window': self.window}
+
+    region.Region = Region
+    raster.RasterRow = RasterRow
+    buffer_.Buffer = Buffer
+
+    modules = {'grass': grass, 'grass.script': script,
+               'grass.script.array': array, 'grass.exceptions': exceptions,
+               'grass.pygrass': pygrass, 'grass.pygrass.gis': gis,
+               'grass.pygrass.gis.region': region,
+               'grass.pygrass.raster': raster,
+               'grass.pygrass.raster.buffer': buffer_}
+
+    # r.in.aw3d imports the Python 2 names of the download modules
+    try:
+        import urllib2
+    except ImportError:
+        import urllib.request
+        import http.cookiejar
+        modules['urllib2'] = urllib.request
+        modules['cookielib'] = http.cookiejar
+
+    sys.modules.update(modules)
+
+
+def load_script(filename, name):
+    """Load the script filename as module name (the file name is no module name)"""
+    install()
+    if name in sys.modules:
+        return sys.modules[name]
+    path = os.path.join(ROOT, filename)
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    except ImportError:
+        import imp
+        module = imp.load_source(name, path)
+    return module
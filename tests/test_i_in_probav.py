@@ -0,0 +1,139 @@
+"""Tests of i.in.probav: the region window, the resolution of the
+coordinates and the native import of south to north files
+
+The native import writes a small NetCDF file with netCDF4 and is skipped
+without it; the written map is kept in memory by grass_standin.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import grass_standin
+
+probav = grass_standin.load_script('i.in.probav.py', 'i_in_probav')
+
+RES = 0.25
+
+
+class FakeVariable(object):
+    def __init__(self, values=None, **attrs):
+        self.values = values
+        self.__dict__.update(attrs)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+
+class FakeDataset(object):
+    """The variables and global attributes of a NetCDF dataset"""
+
+    def __init__(self, variables, **attrs):
+        self.variables = variables
+        self.__dict__.update(attrs)
+
+
+class RegionWindowTest(unittest.TestCase):
+    # a grid of 8 x 12 cells from 52N 10E
+    grid = (52.0, 10.0, RES, RES, 8, 12)
+
+    def window(self, **region):
+        return probav.region_window(*(self.grid + (region,)))
+
+    def test_inside(self):
+        self.assertEqual(self.window(n=51.5, s=51.0, w=10.5, e=11.5),
+                         (2, 4, 2, 6))
+
+    def test_not_aligned(self):
+        # edges inside a cell include the whole cell
+        self.assertEqual(self.window(n=51.4, s=51.1, w=10.6, e=11.4),
+                         (2, 4, 2, 6))
+
+    def test_beyond_grid(self):
+        self.assertEqual(self.window(n=53, s=51.5, w=9, e=10.5),
+                         (0, 2, 0, 2))
+
+    def test_outside(self):
+        row_start, row_stop, col_start, col_stop = self.window(
+            n=51.5, s=51.0, w=14, e=15)
+        self.assertEqual(col_start, col_stop)
+
+
+class CoordinateResolutionTest(unittest.TestCase):
+    def test_spacing(self):
+        lat = np.array([51.875, 51.625, 51.375])
+        dataset = FakeDataset({'lat': FakeVariable(lat)})
+        self.assertAlmostEqual(
+            probav.coordinate_resolution(dataset, 'lat', lat, 'lat'), RES)
+
+    @unittest.skipUnless(probav.NATIVE, "reading the bounds requires NumPy and netCDF4")
+    def test_bounds(self):
+        lat = np.array([51.875])
+        dataset = FakeDataset({'lat': FakeVariable(lat, bounds='lat_bnds'),
+                               'lat_bnds': FakeVariable(np.array([[52.0, 51.75]]))})
+        self.assertAlmostEqual(
+            probav.coordinate_resolution(dataset, 'lat', lat, 'lat'), RES)
+
+    def test_attribute(self):
+        lon = np.array([10.125])
+        dataset = FakeDataset({'lon': FakeVariable(lon)},
+                              geospatial_lon_resolution='0.25 degree')
+        self.assertAlmostEqual(
+            probav.coordinate_resolution(dataset, 'lon', lon, 'lon'), RES)
+
+    def test_unknown(self):
+        lon = np.array([10.125])
+        dataset = FakeDataset({'lon': FakeVariable(lon)})
+        self.assertIsNone(probav.coordinate_resolution(dataset, 'lon', lon, 'lon'))
+
+
+@unittest.skipUnless(probav.NATIVE, "the native import requires NumPy and netCDF4")
+class ImportNativeTest(unittest.TestCase):
+    """A file of 8 x 12 cells from 52N 10E, its rows from south to north"""
+
+    def setUp(self):
+        grass_standin.reset()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'ndvi.nc')
+        rows, cols = np.indices((8, 12))
+        # digital numbers from the north, row by row
+        self.dn = (10 * rows + cols).astype(np.uint8)
+        dataset = probav.Dataset(self.path, 'w')
+        try:
+            dataset.createDimension('lat', 8)
+            dataset.createDimension('lon', 12)
+            lat = dataset.createVariable('lat', 'f8', ('lat',))
+            lat[:] = 50.0 + RES / 2 + RES * np.arange(8)
+            lon = dataset.createVariable('lon', 'f8', ('lon',))
+            lon[:] = 10.0 + RES / 2 + RES * np.arange(12)
+            ndvi = dataset.createVariable('NDVI', 'u1', ('lat', 'lon'),
+                                          fill_value=255)
+            ndvi[:] = self.dn[::-1]
+        finally:
+            dataset.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_flip(self):
+        grid = probav.import_native(self.path, 'ndvi', 1, 0, 1, dn=True)
+        rows = grass_standin.maps['ndvi']['rows']
+        self.assertTrue((rows == self.dn).all())
+        self.assertAlmostEqual(grid['north'], 52.0)
+
+    def test_region(self):
+        # blocks of a single row
+        region = {'n': 51.5, 's': 51.0, 'w': 10.5, 'e': 11.5}
+        grid = probav.import_native(self.path, 'ndvi', 1, 0, 1e-5,
+                                    region=region, dn=True)
+        rows = grass_standin.maps['ndvi']['rows']
+        self.assertTrue((rows == self.dn[2:4, 2:6]).all())
+        self.assertEqual((grid['row_start'], grid['col_start']), (2, 2))
+        self.assertAlmostEqual(grid['north'], 51.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,433 @@
+"""Tests of r.in.aw3d: the void and cluster fill of the NumPy engine, the
+local SRTM store and the stage manifest
+
+The DSM and SRTM grids are synthetic planes, so the filled values are
+known: the SRTM plane is the DSM plane shifted by a constant offset. The
+SRTM tiles of the store have 11 x 11 cells (0.1 degree).
+"""
+
+import os
+import shutil
+import zipfile
+import tempfile
+import multiprocessing
+import unittest
+
+import numpy as np
+
+import grass_standin
+
+aw3d = grass_standin.load_script('r.in.aw3d.py', 'r_in_aw3d')
+
+OFFSET = 7.0
+
+# Python 2 always forks the worker processes on POSIX
+START_METHOD = getattr(multiprocessing, 'get_start_method', lambda: 'fork')()
+
+
+def plane(shape):
+    rows, cols = np.indices(shape)
+    return 500.0 + 2.0 * rows + 3.0 * cols
+
+
+def grids(shape=(40, 50)):
+    """Return DSM and SRTM planes and two voids of the DSM"""
+    surface = plane(shape)
+    void = np.zeros(shape, dtype=bool)
+    void[5:12, 6:15] = True
+    void[25:33, 30:41] = True
+    dsm = surface.astype(np.int16)
+    dsm[void] = -9999
+    srtm = (surface - OFFSET).astype(np.float32)
+    return dsm, srtm, void, surface
+
+
+class SampleCellsTest(unittest.TestCase):
+    def setUp(self):
+        self.mask = np.zeros((40, 40), dtype=bool)
+        self.mask[:, 10:30] = True
+
+    def test_random(self):
+        rows, cols = aw3d.sample_cells(self.mask, 10, np.random.RandomState(1))
+        self.assertEqual(len(rows), 80)
+        self.assertTrue(self.mask[rows, cols].all())
+        self.assertEqual(len(set(zip(rows, cols))), 80)
+
+    def test_max_points(self):
+        rows, cols = aw3d.sample_cells(self.mask, 10, np.random.RandomState(1),
+                                       max_points=25)
+        self.assertEqual(len(rows), 25)
+
+    def test_no_points(self):
+        rows, cols = aw3d.sample_cells(self.mask, 0, np.random.RandomState(1))
+        self.assertEqual(len(rows), 0)
+
+    def test_seed(self):
+        first = aw3d.sample_cells(self.mask, 5, np.random.RandomState(3))
+        second = aw3d.sample_cells(self.mask, 5, np.random.RandomState(3))
+        self.assertTrue((first[0] == second[0]).all())
+        self.assertTrue((first[1] == second[1]).all())
+
+    def test_stratified(self):
+        mask = np.ones((40, 40), dtype=bool)
+        rows, cols = aw3d.sample_cells(mask, 1, np.random.RandomState(1),
+                                       'stratified')
+        # one point in each stratum of 10 x 10 cells
+        self.assertEqual(len(rows), 16)
+        strata = sorted(zip(rows // 10, cols // 10))
+        self.assertEqual(strata, [(r, c) for r in range(4) for c in range(4)])
+
+
+class FindVoidsTest(unittest.TestCase):
+    def setUp(self):
+        self.dsm = np.full((4, 5), 100, dtype=np.int16)
+        self.dsm[0, 0] = -9999
+
+    def test_without_quality(self):
+        void = aw3d.find_voids(self.dsm, None, -9999, ['1'])
+        self.assertEqual(list(zip(*np.nonzero(void))), [(0, 0)])
+
+    def test_quality(self):
+        quality = np.zeros(self.dsm.shape, dtype=np.uint8)
+        quality[1, 2] = 1
+        quality[2, 3] = 3
+        quality[3, 4] = 2
+        void = aw3d.find_voids(self.dsm, quality, '-9999', ['1', '3'])
+        # the hole value is a void whatever the quality
+        self.assertEqual(list(zip(*np.nonzero(void))), [(0, 0), (1, 2), (2, 3)])
+
+
+class VoidClustersTest(unittest.TestCase):
+    def setUp(self):
+        self.void = np.zeros((10, 12), dtype=bool)
+        self.void[1:3, 1:4] = True
+        # connected diagonally
+        self.void[3, 4] = True
+        self.void[6:9, 8:10] = True
+
+    def check(self):
+        labels, boxes = aw3d.void_clusters(self.void)
+        self.assertEqual(sorted(box[1:] for box in boxes),
+                         [(1, 4, 1, 5), (6, 9, 8, 10)])
+        self.assertTrue(((labels > 0) == self.void).all())
+        for label, row_start, row_stop, col_start, col_stop in boxes:
+            cluster = labels == label
+            rows, cols = np.nonzero(cluster)
+            self.assertEqual((rows.min(), rows.max() + 1, cols.min(), cols.max() + 1),
+                             (row_start, row_stop, col_start, col_stop))
+
+    def test_clusters(self):
+        self.check()
+
+    def test_without_scipy(self):
+        scipy = aw3d.SCIPY
+        aw3d.SCIPY = False
+        try:
+            self.check()
+        finally:
+            aw3d.SCIPY = scipy
+
+    def test_no_voids(self):
+        labels, boxes = aw3d.void_clusters(np.zeros((4, 4), dtype=bool))
+        self.assertEqual(boxes, [])
+
+
+class FillVoidsTest(unittest.TestCase):
+    def test_delta(self):
+        dsm, srtm, void, surface = grids()
+        filled = aw3d.fill_voids(dsm, srtm, void, '10', np.random.RandomState(1),
+                                 method='delta')
+        self.assertTrue(np.allclose(filled, surface.astype(np.int16), atol=1e-3))
+
+    def test_delta_srtm_void(self):
+        dsm, srtm, void, surface = grids()
+        srtm[7, 8] = np.nan
+        filled = aw3d.fill_voids(dsm, srtm, void, '10', np.random.RandomState(1),
+                                 method='delta')
+        self.assertTrue(np.isnan(filled[7, 8]))
+        self.assertEqual(np.isnan(filled).sum(), 1)
+
+    @unittest.skipUnless(aw3d.SCIPY, "linear interpolation requires SciPy")
+    def test_points(self):
+        dsm, srtm, void, surface = grids()
+        # SRTM on the DSM plane, the interpolation of a plane is exact
+        srtm = surface.astype(np.float32)
+        filled = aw3d.fill_voids(dsm, srtm, void, '20', np.random.RandomState(1))
+        self.assertTrue(np.allclose(filled[void], surface[void], atol=1))
+        self.assertTrue((filled[~void] == dsm[~void]).all())
+
+    def test_invalid(self):
+        dsm, srtm, void, surface = grids()
+        # invalid cells next to a void are no support points
+        invalid = void.copy()
+        invalid[4, 6:15] = True
+        dsm[4, 6:15] = 10000
+        filled = aw3d.fill_voids(dsm, srtm, void, '10', np.random.RandomState(1),
+                                 invalid=invalid, method='delta')
+        self.assertTrue(np.allclose(filled[void], surface.astype(np.int16)[void],
+                                    atol=1e-3))
+        self.assertTrue(np.isnan(filled[4, 6:15]).all())
+
+    def test_max_points_per_void(self):
+        dsm, srtm, void, surface = grids()
+        drawn = []
+        sample_cells = aw3d.sample_cells
+
+        def counted(*args, **kwargs):
+            rows, cols = sample_cells(*args, **kwargs)
+            drawn.append(len(rows))
+            return rows, cols
+
+        aw3d.sample_cells = counted
+        try:
+            aw3d.fill_voids(dsm, srtm, void, '100', np.random.RandomState(1),
+                            max_points=20)
+        finally:
+            aw3d.sample_cells = sample_cells
+        self.assertEqual(drawn, [20, 20])
+
+    def test_no_voids(self):
+        dsm, srtm, void, surface = grids()
+        void[...] = False
+        filled = aw3d.fill_voids(dsm, srtm, void, '10', np.random.RandomState(1))
+        self.assertTrue((filled == dsm).all())
+
+
+class FillClustersTest(unittest.TestCase):
+    def test_delta(self):
+        dsm, srtm, void, surface = grids()
+        filled = aw3d.fill_clusters(dsm, srtm, void, np.random.RandomState(1),
+                                    random='10', method='delta')
+        self.assertTrue(np.allclose(filled, surface.astype(np.int16), atol=1e-3))
+
+    def test_invalid(self):
+        dsm, srtm, void, surface = grids()
+        invalid = void.copy()
+        invalid[4, 6:15] = True
+        dsm[4, 6:15] = 10000
+        filled = aw3d.fill_clusters(dsm, srtm, void, np.random.RandomState(1),
+                                    invalid=invalid, random='10', method='delta')
+        self.assertTrue(np.allclose(filled[void], surface.astype(np.int16)[void],
+                                    atol=1e-3))
+        self.assertTrue(np.isnan(filled[4, 6:15]).all())
+
+    def test_seed(self):
+        dsm, srtm, void, surface = grids()
+        first = aw3d.fill_clusters(dsm, srtm, void, np.random.RandomState(5),
+                                   random='10')
+        second = aw3d.fill_clusters(dsm, srtm, void, np.random.RandomState(5),
+                                    random='10')
+        self.assertTrue((first == second).all())
+
+    @unittest.skipUnless(START_METHOD == 'fork',
+                         "the worker processes need the loaded script")
+    def test_processes(self):
+        dsm, srtm, void, surface = grids()
+        single = aw3d.fill_clusters(dsm, srtm, void, np.random.RandomState(5),
+                                    random='10')
+        parallel = aw3d.fill_clusters(dsm, srtm, void, np.random.RandomState(5),
+                                      nprocs=2, random='10')
+        self.assertTrue((single == parallel).all())
+
+    def test_border(self):
+        # two tiles of 40 x 30 cells with a halo of 12 cells share a void
+        # on their border; the SRTM is no plane, so the points matter
+        rows, cols = np.indices((40, 60))
+        surface = 500.0 + 20.0 * np.sin(rows / 3.0) * np.cos(cols / 4.0)
+        void = np.zeros((40, 60), dtype=bool)
+        void[10:20, 26:35] = True
+        dsm = surface.astype(np.int16)
+        dsm[void] = -9999
+        srtm = (surface - OFFSET + 5.0 * np.sin(rows + cols)).astype(np.float32)
+        west = (slice(None), slice(0, 42))
+        east = (slice(None), slice(18, 60))
+        tiles = []
+        for window, origin in ((west, (100, 200)), (east, (100, 218))):
+            tiles.append(aw3d.fill_clusters(dsm[window], srtm[window],
+                                            void[window],
+                                            np.random.RandomState(3),
+                                            origin=origin, random='30',
+                                            method='points'))
+        self.assertFalse(np.isnan(tiles[0][void[west]]).any())
+        self.assertTrue((tiles[0][:, 18:] == tiles[1][:, :24]).all())
+
+
+
+def write_tile(directory, tile, data, zipped=False):
+    """Write the int16 grid data as (zipped) big-endian HGT file of tile"""
+    raw = np.asarray(data, dtype='>i2').tobytes()
+    if zipped:
+        archive = zipfile.ZipFile(os.path.join(directory, tile + '.hgt.zip'), 'w')
+        try:
+            archive.writestr(tile + '.hgt', raw)
+        finally:
+            archive.close()
+    else:
+        with open(os.path.join(directory, tile + '.hgt'), 'wb') as fd:
+            fd.write(raw)
+
+
+class SrtmStoreTest(unittest.TestCase):
+    def setUp(self):
+        grass_standin.reset()
+        self.tmpdir = tempfile.mkdtemp()
+        rows, cols = np.indices((11, 11))
+        self.west = (100 * rows + cols).astype(np.int16)
+        self.east = self.west + 5000
+        write_tile(self.tmpdir, 'N51E010', self.west)
+        write_tile(self.tmpdir, 'N51E011', self.east, zipped=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_files(self):
+        store = aw3d.SrtmStore(self.tmpdir)
+        self.assertEqual(sorted(store.files), ['N51E010', 'N51E011'])
+        self.assertEqual(store.tile_side('N51E010'), 11)
+        self.assertEqual(store.tile_side('N51E011'), 11)
+        self.assertTrue((store.tile('N51E011') == self.east).all())
+
+    def test_tile_names(self):
+        bounds = {'n': 51.5, 's': 50.5, 'w': 10.5, 'e': 12}
+        self.assertEqual(aw3d.SrtmStore(self.tmpdir).tile_names(bounds),
+                         ['N50E010', 'N50E011', 'N51E010', 'N51E011'])
+
+    def test_window(self):
+        # cell centres 0.08 degree inside the tile, nearest SRTM cell 1
+        bounds = {'n': 51.97, 's': 51.07, 'w': 10.03, 'e': 10.93,
+                  'rows': 9, 'cols': 9}
+        window = aw3d.SrtmStore(self.tmpdir).window(bounds)
+        self.assertEqual(window.dtype, np.float32)
+        self.assertTrue((window == self.west[1:10, 1:10]).all())
+
+    def test_window_across_tiles(self):
+        bounds = {'n': 51.97, 's': 51.07, 'w': 10.53, 'e': 11.43,
+                  'rows': 9, 'cols': 9}
+        window = aw3d.SrtmStore(self.tmpdir).window(bounds)
+        self.assertTrue((window[:, :5] == self.west[1:10, 6:11]).all())
+        self.assertTrue((window[:, 5:] == self.east[1:10, 1:5]).all())
+
+    def test_missing_tile(self):
+        bounds = {'n': 51.97, 's': 51.07, 'w': 9.53, 'e': 10.43,
+                  'rows': 9, 'cols': 9}
+        window = aw3d.SrtmStore(self.tmpdir).window(bounds)
+        self.assertTrue(np.isnan(window[:, :5]).all())
+        self.assertTrue((window[:, 5:] == self.west[1:10, 1:5]).all())
+        self.assertEqual(len(grass_standin.warnings), 1)
+
+    def test_voids(self):
+        self.west[3, 4] = -32768
+        write_tile(self.tmpdir, 'N51E010', self.west)
+        bounds = {'n': 51.97, 's': 51.07, 'w': 10.03, 'e': 10.93,
+                  'rows': 9, 'cols': 9}
+        window = aw3d.SrtmStore(self.tmpdir).window(bounds)
+        self.assertTrue(np.isnan(window[2, 3]))
+        self.assertEqual(np.isnan(window).sum(), 1)
+
+    def test_cache_size(self):
+        store = aw3d.SrtmStore(self.tmpdir, size=1)
+        bounds = {'n': 51.97, 's': 51.07, 'w': 10.53, 'e': 11.43,
+                  'rows': 9, 'cols': 9}
+        store.window(bounds)
+        self.assertEqual(list(store.tiles), ['N51E011'])
+
+
+
+class ManifestTest(unittest.TestCase):
+    params = {'input': 'N051E010_AVE_DSM.tif', 'method': 'points'}
+
+    def setUp(self):
+        grass_standin.reset()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'dem.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def completed(self, params=None, resume=True):
+        manifest = aw3d.Manifest(self.path, params or self.params, resume)
+        manifest.complete('import', ['run_jaxa_patch'])
+        grass_standin.maps['run_jaxa_patch'] = {}
+        return manifest
+
+    def test_without_path(self):
+        manifest = aw3d.Manifest()
+        manifest.complete('import', ['run_jaxa_patch'])
+        self.assertFalse(manifest.completed('import'))
+        grass_standin.maps['run_jaxa_patch'] = {}
+        self.assertTrue(manifest.completed('import'))
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_resume(self):
+        self.completed()
+        manifest = aw3d.Manifest(self.path, self.params, resume=True)
+        self.assertTrue(manifest.completed('import'))
+        self.assertFalse(manifest.completed('srtm'))
+        self.assertFalse(manifest.finished())
+        # the manifest is replaced atomically
+        self.assertEqual(os.listdir(self.tmpdir), ['dem.json'])
+
+    def test_without_resume(self):
+        self.completed()
+        manifest = aw3d.Manifest(self.path, self.params)
+        self.assertFalse(manifest.completed('import'))
+
+    def test_changed_params(self):
+        self.completed()
+        params = dict(self.params, method='delta')
+        manifest = aw3d.Manifest(self.path, params, resume=True)
+        self.assertFalse(manifest.completed('import'))
+        self.assertEqual(len(grass_standin.warnings), 1)
+
+    def test_missing_map(self):
+        self.completed()
+        del grass_standin.maps['run_jaxa_patch']
+        manifest = aw3d.Manifest(self.path, self.params, resume=True)
+        self.assertFalse(manifest.completed('import'))
+
+    def test_finish(self):
+        self.completed().finish()
+        manifest = aw3d.Manifest(self.path, self.params, resume=True)
+        self.assertTrue(manifest.finished())
+        self.assertFalse(manifest.completed('import'))
+
+    def test_overwrite(self):
+        overwrite = aw3d.grass.overwrite
+        aw3d.grass.overwrite = lambda: False
+        try:
+            # only a resumed run may replace its output without --o
+            self.assertFalse(aw3d.Manifest().overwrite())
+            self.assertFalse(aw3d.Manifest(self.path, self.params).overwrite())
+            self.assertTrue(aw3d.Manifest(self.path, self.params, True).overwrite())
+        finally:
+            aw3d.grass.overwrite = overwrite
+        self.assertTrue(aw3d.Manifest().overwrite())
+
+
+class RunTest(unittest.TestCase):
+    def test_temp_maps(self):
+        maps = aw3d.temp_maps('run')
+        self.assertEqual(maps['mask'], 'run_mask')
+        self.assertEqual(len(set(maps.values())), len(maps))
+
+    def test_resumable_run(self):
+        self.assertEqual(aw3d.resumable_run('dem'), aw3d.resumable_run('dem'))
+        # the maps of one output are no maps of another
+        names = set(aw3d.temp_maps(aw3d.resumable_run('dem')).values())
+        for output in ('dem_buffer', 'dem_x', 'dem_fill'):
+            other = set(aw3d.temp_maps(aw3d.resumable_run(output)).values())
+            self.assertFalse(names & other)
+
+    def test_remove_temp_maps(self):
+        grass_standin.reset()
+        grass_standin.maps.update((name, {}) for name in ('run_mask', 'run_fill_data',
+                                                          'run_x_mask', 'run_mask_x'))
+        aw3d.remove_temp_maps('run')
+        self.assertEqual(grass_standin.commands,
+                         [('g.remove', {'flags': 'f', 'type': 'raster',
+                                        'name': 'run_fill_data,run_mask',
+                                        'quiet': True})])
+
+
+if __name__ == '__main__':
+    unittest.main()
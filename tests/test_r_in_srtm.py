@@ -0,0 +1,309 @@
+"""Tests of r.in.srtm: tile windows, the mosaic, the water flattening and
+the tile catalog
+
+Synthetic 3-arcsec HGT tiles and 1-arcsec SWBD tiles are written into a
+temporary directory and imported with the stand-ins of grass_standin,
+which keep the written raster maps in memory.
+"""
+
+import os
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+import numpy as np
+
+import grass_standin
+
+srtm = grass_standin.load_script('r.in.srtm.py', 'r_in_srtm')
+
+SIZE = 1201
+RES = 1.0 / (SIZE - 1)
+
+
+def write_hgt(directory, tile, values):
+    """Write the int16 grid values as big-endian HGT file of tile"""
+    path = os.path.join(directory, tile + '.hgt')
+    np.asarray(values, dtype='>i2').tofile(path)
+    return path
+
+
+def write_swbd_zip(directory, tile, water):
+    """Write the grid water (1-arcsec, 1: water) as zipped SWBD RAW file"""
+    path = os.path.join(directory, tile + '.raw.zip')
+    archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+    try:
+        archive.writestr(tile + '.raw', np.asarray(water, dtype=np.uint8).tobytes())
+    finally:
+        archive.close()
+    return path
+
+
+class TileWindowTest(unittest.TestCase):
+    north = 52 + 0.5 * RES
+    west = 10 - 0.5 * RES
+
+    def test_without_region(self):
+        self.assertEqual(srtm.tile_window(self.north, self.west, SIZE, RES, None),
+                         (0, SIZE, 0, SIZE))
+
+    def test_region_inside(self):
+        region = {'n': 51.5, 's': 51.25, 'w': 10.25, 'e': 10.5}
+        self.assertEqual(srtm.tile_window(self.north, self.west, SIZE, RES, region),
+                         (600, 901, 300, 601))
+
+    def test_region_not_aligned(self):
+        # edges inside a cell include the whole cell
+        region = {'n': 51.5 - 0.25 * RES, 's': 51.25 + 0.25 * RES,
+                  'w': 10.25 + 0.25 * RES, 'e': 10.5 - 0.25 * RES}
+        self.assertEqual(srtm.tile_window(self.north, self.west, SIZE, RES, region),
+                         (600, 901, 300, 601))
+
+    def test_region_beyond_tile(self):
+        region = {'n': 53, 's': 51.75, 'w': 9, 'e': 10.25}
+        self.assertEqual(srtm.tile_window(self.north, self.west, SIZE, RES, region),
+                         (0, 301, 0, 301))
+
+    def test_region_outside(self):
+        region = {'n': 51.5, 's': 51.25, 'w': 11.25, 'e': 11.5}
+        self.assertIsNone(srtm.tile_window(self.north, self.west, SIZE, RES, region))
+
+    def test_columns(self):
+        region = {'n': 52, 's': 51, 'w': 10.5, 'e': 12}
+        self.assertEqual(srtm.tile_window(self.north, self.west, SIZE, RES,
+                                          region, 2 * SIZE - 1),
+                         (0, SIZE, 600, 2 * SIZE - 1))
+
+
+class MosaicTest(unittest.TestCase):
+    """Mosaic of N51E010, N51E011 and N50E010; N50E011 is missing"""
+
+    def setUp(self):
+        grass_standin.reset()
+        self.tmpdir = tempfile.mkdtemp()
+        west = np.full((SIZE, SIZE), 100, dtype=np.int16)
+        # a void on the seam is taken from the next tile
+        west[5, -1] = srtm.HGT_NODATA
+        east = np.full((SIZE, SIZE), 200, dtype=np.int16)
+        east[5, 1] = srtm.HGT_NODATA
+        south = np.full((SIZE, SIZE), 300, dtype=np.int16)
+        self.tiles = [(write_hgt(self.tmpdir, tile, values), tile, False)
+                      for tile, values in (('N51E010', west), ('N51E011', east),
+                                           ('N50E010', south))]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def mosaic(self, region=None):
+        srtm.import_mosaic(self.tiles, 'mosaic', False, region)
+        return grass_standin.maps['mosaic']
+
+    def test_extent(self):
+        result = self.mosaic()
+        # the tiles share their edge rows and columns
+        self.assertEqual(result['rows'].shape, (2 * SIZE - 1, 2 * SIZE - 1))
+        window = result['window']
+        self.assertAlmostEqual(window['north'], 52 + 0.5 * RES)
+        self.assertAlmostEqual(window['south'], 50 - 0.5 * RES)
+        self.assertAlmostEqual(window['west'], 10 - 0.5 * RES)
+        self.assertAlmostEqual(window['east'], 12 + 0.5 * RES)
+
+    def test_seams(self):
+        rows = self.mosaic()['rows']
+        seam = SIZE - 1
+        # the first tile of a row wins on the seam
+        self.assertEqual(rows[0, seam], 100)
+        self.assertEqual(rows[seam, 0], 100)
+        self.assertEqual(rows[seam + 1, 0], 300)
+        # unless it has a void there
+        self.assertEqual(rows[5, seam], 200)
+        # voids without another tile stay null
+        self.assertEqual(rows[5, seam + 1], srtm.CELL_NULL)
+        self.assertEqual(rows[0, seam + 1], 200)
+
+    def test_missing_tile(self):
+        rows = self.mosaic()['rows']
+        self.assertTrue((rows[SIZE:, SIZE:] == srtm.CELL_NULL).all())
+        self.assertEqual(rows[SIZE - 1, SIZE], 200)
+
+    def test_region(self):
+        full = self.mosaic()['rows']
+        region = {'n': 51.5, 's': 50.75, 'w': 10.9, 'e': 11.1}
+        part = self.mosaic(region)
+        row_start, row_stop, col_start, col_stop = srtm.tile_window(
+            52 + 0.5 * RES, 10 - 0.5 * RES, 2 * SIZE - 1, RES, region,
+            2 * SIZE - 1)
+        self.assertTrue((part['rows'] == full[row_start:row_stop,
+                                              col_start:col_stop]).all())
+        self.assertAlmostEqual(part['window']['north'],
+                               52 + 0.5 * RES - row_start * RES)
+        self.assertAlmostEqual(part['window']['west'],
+                               10 - 0.5 * RES + col_start * RES)
+
+    @unittest.skipUnless(srtm.GDAL, "GeoTIFFs require the GDAL library")
+    def test_cog_staged(self):
+        # a mosaic larger than MEM_CELLS is staged on disk
+        mem_cells = srtm.MEM_CELLS
+        srtm.MEM_CELLS = SIZE * SIZE
+        try:
+            srtm.import_mosaic(self.tiles, 'mosaic', False, cog=self.tmpdir)
+        finally:
+            srtm.MEM_CELLS = mem_cells
+        path = os.path.join(self.tmpdir, 'mosaic.tif')
+        self.assertFalse(os.path.exists(path + '.tmp.tif'))
+        dataset = srtm.gdal.Open(path)
+        values = dataset.GetRasterBand(1).ReadAsArray()
+        dataset = None
+        rows = grass_standin.maps['mosaic']['rows']
+        self.assertTrue((values == np.where(rows == srtm.CELL_NULL,
+                                            srtm.HGT_NODATA, rows)).all())
+
+    def test_different_resolution(self):
+        self.tiles[1] = (self.tiles[1][0], 'N51E011', True)
+        self.assertRaises(grass_standin.ScriptError, self.mosaic)
+
+
+@unittest.skipUnless(srtm.SCIPY, "flattening requires SciPy")
+class FlattenTest(unittest.TestCase):
+    """HGT tile N51E010 with the water bodies of its SWBD tile"""
+
+    def setUp(self):
+        grass_standin.reset()
+        self.tmpdir = tempfile.mkdtemp()
+        rows, cols = np.indices((SIZE, SIZE))
+        self.elevation = (1000 + rows + cols).astype(np.int16)
+        swbd = np.zeros((3 * SIZE - 2, 3 * SIZE - 2), dtype=np.uint8)
+        # every third SWBD cell is a cell of the 3-arcsec elevation
+        swbd[300:331, 300:331] = 1
+        self.lake = (slice(100, 111), slice(100, 111))
+        swbd[900:913, 600:613] = 1
+        self.river = (slice(300, 305), slice(200, 205))
+        self.elevation[302, 202] = srtm.HGT_NODATA
+        swbd[1500:1504, 1500:1504] = 1
+        self.void = (slice(500, 502), slice(500, 502))
+        self.elevation[self.void] = srtm.HGT_NODATA
+        self.elevation[700, 700] = srtm.HGT_NODATA
+        self.hgt = write_hgt(self.tmpdir, 'N51E010', self.elevation)
+        self.swbd = write_swbd_zip(self.tmpdir, 'N51E010', swbd)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def combined(self, method='flatten', region=None):
+        srtm.import_combined('N51E010', self.hgt, False, self.swbd, True,
+                             'dem', False, method, 'water', region)
+        return grass_standin.maps['dem']['rows'], grass_standin.maps['water']['rows']
+
+    def test_flatten(self):
+        dem, water = self.combined()
+        # the lowest valid elevation of each water body
+        self.assertTrue((dem[self.lake] == 1200).all())
+        self.assertTrue((dem[self.river] == 1500).all())
+        # water bodies without valid elevation and land voids stay null
+        self.assertTrue((dem[self.void] == srtm.CELL_NULL).all())
+        self.assertEqual(dem[700, 700], srtm.CELL_NULL)
+        land = water == 0
+        self.assertTrue((dem[land & (dem != srtm.CELL_NULL)] ==
+                         self.elevation[land & (dem != srtm.CELL_NULL)]).all())
+
+    def test_mask(self):
+        dem, water = self.combined()
+        expected = np.zeros((SIZE, SIZE), dtype=np.int32)
+        for body in (self.lake, self.river, self.void):
+            expected[body] = 1
+        self.assertTrue((water == expected).all())
+
+    def test_null(self):
+        dem, water = self.combined('null')
+        self.assertTrue((dem[water == 1] == srtm.CELL_NULL).all())
+        self.assertEqual(dem[0, 0], 1000)
+
+    def test_region(self):
+        full = self.combined()[0]
+        region = {'n': 51.95, 's': 51.7, 'w': 10.05, 'e': 10.2}
+        part = self.combined(region=region)[0]
+        row_start, row_stop, col_start, col_stop = srtm.tile_window(
+            52 + 0.5 * RES, 10 - 0.5 * RES, SIZE, RES, region)
+        self.assertTrue((part == full[row_start:row_stop,
+                                      col_start:col_stop]).all())
+
+
+
+class CatalogTest(unittest.TestCase):
+    def setUp(self):
+        grass_standin.reset()
+        self.tmpdir = tempfile.mkdtemp()
+        tile = np.zeros((SIZE, SIZE), dtype=np.int16)
+        write_hgt(self.tmpdir, 'N51E010', tile)
+        # the size of a tile, but no tile name
+        write_hgt(self.tmpdir, 'dem_copy', tile)
+        self.db = srtm.open_catalog(':memory:')
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_not_a_tile_name(self):
+        srtm.update_catalog(self.db, self.tmpdir)
+        self.assertEqual([row[0] for row in self.db.execute("SELECT tile FROM tiles")],
+                         ['N51E010'])
+        self.assertEqual(len(grass_standin.warnings), 1)
+        self.assertTrue('dem_copy.hgt' in grass_standin.warnings[0])
+
+    def test_query(self):
+        srtm.update_catalog(self.db, self.tmpdir)
+        region = {'n': 51.5, 's': 51.25, 'w': 10.25, 'e': 10.5}
+        tiles = srtm.query_catalog(self.db, False, region)
+        self.assertEqual([tile for path, tile, arcsec in tiles], ['N51E010'])
+        self.assertEqual(tiles[0][2], 3)
+
+
+class ImportCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        tile = np.zeros((SIZE, SIZE), dtype=np.int16)
+        self.path = write_hgt(self.tmpdir, 'N51E010', tile)
+        os.mkdir(os.path.join(self.tmpdir, 'copy'))
+        self.copy = write_hgt(os.path.join(self.tmpdir, 'copy'), 'N51E010', tile)
+        self.cache = srtm.ImportCache(os.path.join(self.tmpdir, 'cache'), 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_content(self):
+        # a copy of a tile has the key of the tile
+        self.assertEqual(self.cache.key(self.path, False, False, True),
+                         self.cache.key(self.copy, False, False, True))
+        self.assertNotEqual(self.cache.key(self.path, False, False, True),
+                            self.cache.key(self.path, False, False, False))
+
+    def test_catalog_checksum(self):
+        stat = os.stat(self.path)
+        realpath = os.path.realpath(self.path)
+        self.cache.checksums[realpath] = (stat.st_size, stat.st_mtime, 'catalog')
+        self.assertEqual(self.cache.checksum(self.path), 'catalog')
+        # the tile changed since the catalog was updated
+        self.cache.checksums[realpath] = (stat.st_size, stat.st_mtime - 1, 'catalog')
+        self.assertEqual(self.cache.checksum(self.path),
+                         srtm.file_checksum(self.path))
+
+
+class WorkerTest(unittest.TestCase):
+    def test_error(self):
+        # a broken tile is reported, not raised
+        import_tile = srtm.import_tile
+
+        def broken(**kwargs):
+            raise RuntimeError("not a valid tile")
+        srtm.import_tile = broken
+        try:
+            result = srtm.import_tile_worker(dict(infile='N51E010.hgt',
+                                                  tileout='N51E010'))
+        finally:
+            srtm.import_tile = import_tile
+        self.assertEqual(result, ('N51E010.hgt', 'N51E010', 'not a valid tile'))
+
+
+if __name__ == '__main__':
+    unittest.main()